@@ -171,6 +171,10 @@ LOGGING = {
             'handlers': ['file', 'console'],
             'level': 'INFO',
         },
+        'dash_plotly': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+        },
 
     },
 }
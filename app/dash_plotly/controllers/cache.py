@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedLRUCache:
+    # Bounded LRU cache cleared whenever the data version changes, the version
+    # (e.g. the last stock_dataupdatehistory date) is checked at most every
+    # check_interval seconds so hits don't touch the database.
+    def __init__(self, max_entries, version_loader, check_interval=10.0):
+        self.max_entries = max_entries
+        self.version_loader = version_loader
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def check_version(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return self.version
+        version = self.version_loader()
+        with self.lock:
+            self.checked_at = now
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+        return version
+
+    def get(self, key, builder):
+        self.check_version()
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = builder()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'version': self.version}
@@ -0,0 +1,59 @@
+import numpy as np
+
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+
+def lttb(x, y, threshold):
+    # largest triangle three buckets, returns the indexes of the points kept
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # the first and last points are kept, the others are split into threshold - 2 buckets
+    edges = (np.arange(threshold - 1) * ((count - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = count - 1
+    indexes = np.empty(threshold, dtype=np.int64)
+    indexes[0] = 0
+    indexes[-1] = count - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # the average of the next bucket (or the last point) is the third point
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs((x[selected] - average_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (average_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indexes[bucket + 1] = selected
+    return indexes
+
+
+def period_keys(dates, period):
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    if period == WEEKLY:
+        # weeks starting on monday, 1970-01-01 was a thursday
+        return (days + 3) // 7
+    return dates.astype('datetime64[M]').astype(np.int64)
+
+
+def period_start(days, period):
+    # monday of the week or first day of the month, like the rollup tables' period_date
+    days = np.asarray(days).astype('datetime64[D]')
+    if period == WEEKLY:
+        return days - (days.astype(np.int64) + 3) % 7
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def aggregate_candles(dates, open_prices, close_prices, high_prices, low_prices, period):
+    # weekly or monthly candles from daily rows sorted by date, dated by the start of
+    # their period so they line up with the rollup tables
+    if len(dates) == 0:
+        return dates, open_prices, close_prices, high_prices, low_prices
+    keys = period_keys(dates, period)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(dates)] - 1
+    return (period_start(dates[starts], period), open_prices[starts], close_prices[ends],
+            np.maximum.reduceat(high_prices, starts), np.minimum.reduceat(low_prices, starts))
@@ -1,40 +1,107 @@
-# Dash packages
-import sqlite3
+import threading
+import time
 
 # Data manipulation packages
+import numpy as np
 import pandas as pd
 # Plotly packages
-import plotly.express as px
+import plotly.graph_objects as go
+# Dash packages
 from django_plotly_dash import DjangoDash
 
+from asx_gym.database import get_read_connection
 from dash_plotly.views.index_view import index_layout
 
-con = sqlite3.connect("db.sqlite3")
+DB_FILE = "db.sqlite3"
+# seconds between two checks for newly ingested index rows
+INDEX_CHECK_INTERVAL = 10.0
 
 app = DjangoDash('AsxIndexFragment')  # replaces dash.Dash
 
-index_df = pd.read_sql_query('SELECT * FROM stock_asxindexdailyhistory order by index_date', con)
-fig = px.line(index_df, x='index_date', y='close_index', color='index_name')
-fig.update_xaxes(
 
-    rangeselector=dict(
-        buttons=list([
-            dict(count=1, label="YTD", step="year", stepmode="todate"),
-            dict(count=1, label="1m", step="month", stepmode="backward"),
-            dict(count=6, label="6m", step="month", stepmode="backward"),
+def build_index_figure(series):
+    fig = go.Figure()
+    for index_name in sorted(series):
+        dates, closes = series[index_name]
+        fig.add_trace(go.Scatter(x=dates, y=closes, mode='lines', name=index_name))
+    fig.update_xaxes(
+
+        rangeselector=dict(
+            buttons=list([
+                dict(count=1, label="YTD", step="year", stepmode="todate"),
+                dict(count=1, label="1m", step="month", stepmode="backward"),
+                dict(count=6, label="6m", step="month", stepmode="backward"),
+
+                dict(count=1, label="1y", step="year", stepmode="backward"),
+                dict(count=2, label="2y", step="year", stepmode="backward"),
+                dict(count=5, label="5y", step="year", stepmode="backward"),
+                dict(step="all")
+            ])
+        ),
+
+    )
+
+    fig.update_layout(xaxis_rangeslider_visible=False,
+                      xaxis_title="Date",
+                      yaxis_title="Index",
+                      legend_title_text="Index",
+                      uirevision='asx-index',
+                      )
+    return fig.to_dict()
+
+
+class IndexChartData:
+    # Index closes loaded on the first request instead of at import. Rows are
+    # inserted with increasing ids, so later refreshes only read the rows above
+    # the last loaded id and merge them into the affected series.
+    def __init__(self, check_interval=INDEX_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.last_id = 0
+        # index name -> (dates, closes) sorted by date
+        self.series = {}
+        self.figure = None
+
+    def get_figure(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.figure is None or now - self.checked_at >= self.check_interval:
+                self.checked_at = now
+                self.refresh()
+            return self.figure
+
+    def refresh(self):
+        con = get_read_connection(DB_FILE)
+        last_id = con.execute('SELECT max(id) FROM stock_asxindexdailyhistory').fetchone()[0] or 0
+        if self.figure is not None and last_id == self.last_id:
+            return
+        new_df = pd.read_sql_query('SELECT index_name,index_date,close_index '
+                                   'FROM stock_asxindexdailyhistory WHERE id>? AND id<=?',
+                                   con, params=(self.last_id, last_id),
+                                   parse_dates=['index_date'])
+        for index_name, rows in new_df.groupby('index_name'):
+            dates = rows['index_date'].values.astype('datetime64[D]')
+            closes = rows['close_index'].values.astype(np.float64)
+            if index_name in self.series:
+                old_dates, old_closes = self.series[index_name]
+                dates = np.concatenate([old_dates, dates])
+                closes = np.concatenate([old_closes, closes])
+            # backfilled days can arrive after later ones
+            if len(dates) > 1 and (dates[1:] < dates[:-1]).any():
+                order = np.argsort(dates, kind='stable')
+                dates, closes = dates[order], closes[order]
+            self.series[index_name] = dates, closes
+        self.last_id = last_id
+        self.figure = build_index_figure(self.series)
+
+
+index_chart_data = IndexChartData()
 
-            dict(count=1, label="1y", step="year", stepmode="backward"),
-            dict(count=2, label="2y", step="year", stepmode="backward"),
-            dict(count=5, label="5y", step="year", stepmode="backward"),
-            dict(step="all")
-        ])
-    ),
 
-)
+def serve_layout():
+    # evaluated per page load, so django startup does not read the index table
+    return index_layout(index_chart_data.get_figure())
 
-fig.update_layout(xaxis_rangeslider_visible=False,
-                  xaxis_title="Date",
-                  yaxis_title="Index",
-                  )
 
-app.layout = index_layout(fig)
+app.layout = serve_layout
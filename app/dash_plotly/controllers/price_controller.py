@@ -1,3 +1,5 @@
+import logging
+
 # Dash packages
 from django_plotly_dash import DjangoDash
 import dash_core_components as dcc
@@ -18,20 +20,88 @@ import sqlite3
 
 from dash.exceptions import PreventUpdate
 
+from asx_gym.database import get_read_connection
+from dash_plotly.controllers.cache import VersionedLRUCache
+from dash_plotly.controllers.search import CompanySearchIndex
+from dash_plotly.controllers.charting import lttb, aggregate_candles, period_start, WEEKLY, MONTHLY
 from dash_plotly.views.price_view import price_layout
 
-con = sqlite3.connect("db.sqlite3")
+logger = logging.getLogger(__name__)
+
+DB_FILE = "db.sqlite3"
+con = get_read_connection(DB_FILE)
 
 app = DjangoDash('StockPriceFragment')  # replaces dash.Dash
 
 company_df = pd.read_sql_query('SELECT id,name,description,code,sector_id FROM stock_company', con)
 sector_df = pd.read_sql_query('SELECT id,name,full_name FROM stock_sector', con)
-
-
-def get_company_stock_data(value):
-    con = sqlite3.connect("db.sqlite3")
-
-    company_id = int(value)
+company_search = CompanySearchIndex(company_df['id'], company_df['name'], company_df['code'])
+
+
+PRICE_CACHE_SIZE = 128
+DEFAULT_COMPANY_ID = 2
+# about one point per pixel of a typical chart, candles need a few pixels each
+MAX_LINE_POINTS = 1000
+MAX_CANDLES = 300
+# data loaded on each side of the visible range so panning stays smooth
+RANGE_PADDING = 0.5
+
+
+def get_price_data_version():
+    con = get_read_connection(DB_FILE)
+    return con.execute('SELECT max(updated_date) FROM stock_dataupdatehistory').fetchone()[0]
+
+
+# company id -> CompanyPriceData, cleared when new daily prices are ingested
+price_cache = VersionedLRUCache(PRICE_CACHE_SIZE, get_price_data_version)
+
+
+class CompanyPriceData:
+    def __init__(self, company_id, company_name, price_df, company_desc, sector_info):
+        self.company_id = company_id
+        self.company_name = company_name
+        self.dates = price_df['price_date'].values.astype('datetime64[D]')
+        self.open_prices = price_df['open_price'].values.astype(np.float64)
+        self.close_prices = price_df['close_price'].values.astype(np.float64)
+        self.high_prices = price_df['high_price'].values.astype(np.float64)
+        self.low_prices = price_df['low_price'].values.astype(np.float64)
+        self.company_desc = company_desc
+        self.sector_info = sector_info
+        self.candles = {}
+        # full range figure, serialized once and returned without rebuilding the traces
+        self.figure = build_price_figure(self)
+
+    def get_candles(self, period):
+        # weekly/monthly candles from the rollup table, aggregated here for databases without it
+        if period not in self.candles:
+            candles = load_rollup_candles(self.company_id, period)
+            if candles is None:
+                candles = aggregate_candles(self.dates, self.open_prices, self.close_prices,
+                                            self.high_prices, self.low_prices, period)
+            self.candles[period] = candles
+        return self.candles[period]
+
+
+def load_rollup_candles(company_id, period):
+    con = get_read_connection(DB_FILE)
+    try:
+        rows = con.execute(
+            'SELECT period_date,open_price,close_price,high_price,low_price '
+            'FROM stock_stockpricerolluphistory WHERE company_id=? AND period=? '
+            'ORDER BY period_date', (company_id, period)).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    if not rows:
+        return None
+    period_dates, open_prices, close_prices, high_prices, low_prices = zip(*rows)
+    return (np.array(period_dates, dtype='datetime64[D]'), np.array(open_prices, dtype=np.float64),
+            np.array(close_prices, dtype=np.float64), np.array(high_prices, dtype=np.float64),
+            np.array(low_prices, dtype=np.float64))
+
+
+def load_company_price_data(company_id):
+    # pooled read only connection of the callback thread
+    con = get_read_connection(DB_FILE)
 
     company = company_df[company_df['id'] == company_id]
 
@@ -39,29 +109,68 @@ def get_company_stock_data(value):
     company_desc = company.iloc[0, 2]
     sector_id = company.iloc[0, 4]
     sector_info = sector_df[sector_df['id'] == sector_id].iloc[0, 2]
-    opacity = 1.0
+    # index seek on (company_id, price_date), rows come back in date order
     price_df = pd.read_sql_query(
-        f'SELECT * FROM stock_stockpricedailyhistory where company_id={company_id} order by price_date',
-        con)
-    fig = go.Figure(
-        [
-            go.Scatter(x=price_df['price_date'], y=price_df['high_price'], name="High", opacity=opacity),
-            go.Scatter(x=price_df['price_date'], y=price_df['low_price'], name="Low", opacity=opacity),
-            go.Scatter(x=price_df['price_date'], y=price_df['open_price'], name="Open", opacity=opacity),
-            go.Scatter(x=price_df['price_date'], y=price_df['close_price'], name="Close", opacity=opacity),
-            go.Candlestick(x=price_df['price_date'],
-                           open=price_df['open_price'],
-                           high=price_df['high_price'],
-                           low=price_df['low_price'],
-                           close=price_df['close_price'], name="Candle Stick")
-        ],
-
-    )
+        'SELECT price_date,open_price,close_price,high_price,low_price '
+        'FROM stock_stockpricedailyhistory WHERE company_id=? ORDER BY price_date',
+        con, params=(company_id,), parse_dates=['price_date'])
+    return CompanyPriceData(company_id, company_name, price_df, company_desc,
+                            f'Sector:{sector_info}')
+
+
+def get_relayout_range(relayout_data):
+    # visible x range of a zoom/pan, None for autorange and other events
+    if not relayout_data:
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        x_range = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        x_range = relayout_data['xaxis.range'][:2]
+    else:
+        return None
+    return tuple(np.datetime64(str(value)[:10], 'D') for value in x_range)
+
+
+def build_price_figure(data, x_range=None):
+    # Only the visible range (plus padding) is sent, line traces are LTTB
+    # downsampled WebGL scatters and wide ranges use weekly/monthly candles.
+    start, end = 0, len(data.dates)
+    if x_range is not None:
+        padding = (x_range[1] - x_range[0]) * RANGE_PADDING
+        start = np.searchsorted(data.dates, x_range[0] - padding, side='left')
+        end = np.searchsorted(data.dates, x_range[1] + padding, side='right')
+        if end <= start:
+            start, end, x_range = 0, len(data.dates), None
+    dates = data.dates[start:end]
+    prices = {'High': data.high_prices[start:end], 'Low': data.low_prices[start:end],
+              'Open': data.open_prices[start:end], 'Close': data.close_prices[start:end]}
+
+    traces = []
+    x_values = dates.astype(np.int64)
+    for name, values in prices.items():
+        indexes = lttb(x_values, values, MAX_LINE_POINTS)
+        traces.append(go.Scattergl(x=dates[indexes], y=values[indexes], name=name, mode='lines'))
+
+    candles = dates, prices['Open'], prices['Close'], prices['High'], prices['Low']
+    candle_name = "Candle Stick"
+    if len(dates) > MAX_CANDLES:
+        period = WEEKLY if len(dates) <= MAX_CANDLES * 5 else MONTHLY
+        candles = data.get_candles(period)
+        # periods overlapping the loaded days
+        first = np.searchsorted(candles[0], period_start(dates[0], period), side='left')
+        last = np.searchsorted(candles[0], dates[-1], side='right')
+        candles = tuple(values[first:last] for values in candles)
+        candle_name = f"Candle Stick ({period})"
+    traces.append(go.Candlestick(x=candles[0], open=candles[1], close=candles[2],
+                                 high=candles[3], low=candles[4], name=candle_name))
+    fig = go.Figure(traces)
 
     fig.update_layout(xaxis_rangeslider_visible=True,
-                      title=company_name,
+                      title=data.company_name,
                       xaxis_title="Date",
                       yaxis_title="Price",
+                      # keeps the user's zoom while the figure is replaced
+                      uirevision=str(data.company_id),
                       )
 
     fig.update_xaxes(
@@ -81,12 +190,18 @@ def get_company_stock_data(value):
         ),
 
     )
+    if x_range is not None:
+        fig.update_xaxes(range=[str(x_range[0]), str(x_range[1])])
 
-    con.close()
-    return fig, company_desc, f'Sector:{sector_info}'
+    return fig.to_dict()
 
 
-fig, company_desc, sector_info = get_company_stock_data(2)
+def get_company_stock_data(value, relayout_data=None):
+    company_id = int(value)
+    data = price_cache.get(company_id, lambda: load_company_price_data(company_id))
+    x_range = get_relayout_range(relayout_data)
+    figure = data.figure if x_range is None else build_price_figure(data, x_range)
+    return figure, data.company_desc, data.sector_info
 
 
 @app.callback(
@@ -97,16 +212,15 @@ def update_options(search_value):
     if not search_value:
         raise PreventUpdate
 
-    options = []
-    df = company_df[company_df['name'].str.contains(search_value, case=False)]
+    return company_search.search(search_value)
 
-    for i in range(len(df)):
-        options.append({"label": df.iloc[i, 1], "value": df.iloc[i, 0]})
 
-    return options
+def serve_layout():
+    # evaluated per page load through the cache, nothing is queried at import
+    return price_layout(*get_company_stock_data(DEFAULT_COMPANY_ID))
 
 
-app.layout = price_layout(fig, company_desc, sector_info)
+app.layout = serve_layout
 
 
 @app.callback(
@@ -115,13 +229,13 @@ app.layout = price_layout(fig, company_desc, sector_info)
         Output('company-info', 'children'),
         Output('sector-info', 'children')
     ],
-    [Input('company_name', 'value')])
-def update_stock_price(value):
-    if not value:
+    [Input('company_name', 'value'), Input('stock-price-graph', 'relayoutData')])
+def update_stock_price(value, relayout_data):
+    if not value and not get_relayout_range(relayout_data):
         raise PreventUpdate
     try:
-        return get_company_stock_data(value)
+        return get_company_stock_data(value or DEFAULT_COMPANY_ID, relayout_data)
 
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception(f'Failed to load the stock prices of company {value}')
         raise PreventUpdate
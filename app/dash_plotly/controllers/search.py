@@ -0,0 +1,78 @@
+MAX_SEARCH_RESULTS = 50
+# substrings up to this length are looked up directly, longer ones through their n-grams
+NGRAM_SIZE = 3
+
+
+class CompanySearchIndex:
+    # Typeahead index over lowercased company names and ticker codes, built once.
+    # Prefix matches come from a trie, other substring matches from an n-gram
+    # index, so a search does not scan the company list.
+    def __init__(self, company_ids, names, codes, limit=MAX_SEARCH_RESULTS):
+        self.limit = limit
+        self.options = []
+        self.keys = []
+        self.trie = {}
+        self.ngrams = {}
+        # sorted by name, so every id list below is already in display order
+        companies = sorted(zip(names, codes, company_ids), key=lambda company: company[0].lower())
+        for position, (name, code, company_id) in enumerate(companies):
+            self.options.append({"label": name, "value": int(company_id)})
+            # codes are stored as 'ASX:CSL', only the ticker is searched
+            ticker = (code or '').split(':')[-1]
+            keys = tuple(key for key in {name.lower(), ticker.lower()} if key)
+            self.keys.append(keys)
+            for key in keys:
+                self.add_prefixes(key, position)
+                self.add_ngrams(key, position)
+
+    def add_prefixes(self, key, position):
+        node = self.trie
+        for char in key:
+            node = node.setdefault(char, {})
+            positions = node.setdefault(None, [])
+            if not positions or positions[-1] != position:
+                positions.append(position)
+
+    def add_ngrams(self, key, position):
+        for size in range(1, NGRAM_SIZE + 1):
+            for start in range(len(key) - size + 1):
+                positions = self.ngrams.setdefault(key[start:start + size], [])
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+
+    def prefix_matches(self, query):
+        node = self.trie
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node[None]
+
+    def substring_matches(self, query):
+        if len(query) <= NGRAM_SIZE:
+            return self.ngrams.get(query, [])
+        grams = [query[start:start + NGRAM_SIZE] for start in range(len(query) - NGRAM_SIZE + 1)]
+        candidates = [self.ngrams.get(gram) for gram in grams]
+        if not all(candidates):
+            return []
+        # rarest n-gram first, the survivors are checked against the full query
+        candidates.sort(key=len)
+        common = set(candidates[0]).intersection(*candidates[1:])
+        return sorted(position for position in common
+                      if any(query in key for key in self.keys[position]))
+
+    def search(self, query):
+        query = query.strip().lower()
+        if not query:
+            return []
+        results = []
+        seen = set()
+        # names and codes starting with the query come first
+        for matches in (self.prefix_matches(query), self.substring_matches(query)):
+            for position in matches:
+                if position not in seen:
+                    seen.add(position)
+                    results.append(self.options[position])
+                    if len(results) >= self.limit:
+                        return results
+        return results
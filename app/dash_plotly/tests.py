@@ -1,3 +1,28 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from dash_plotly.controllers.search import CompanySearchIndex
+
+
+class CompanySearchIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = CompanySearchIndex(
+            [1, 2, 3, 4],
+            ['Alpha Resources', 'Aspen Group', 'CSL Limited', 'Commonwealth Bank'],
+            ['ASX:AAR', 'ASX:APZ', 'ASX:CSL', 'ASX:CBA'])
+
+    def search_values(self, query):
+        return [option['value'] for option in self.index.search(query)]
+
+    def test_name_prefix(self):
+        self.assertEqual(self.search_values('as'), [2])
+        self.assertEqual(self.search_values('Comm'), [4])
+
+    def test_bare_ticker(self):
+        self.assertEqual(self.search_values('csl'), [3])
+        self.assertEqual(self.search_values('CBA'), [4])
+
+    def test_exchange_prefix_is_not_indexed(self):
+        self.assertEqual(self.search_values('asx'), [])
+
+    def test_substring(self):
+        self.assertEqual(self.search_values('wealth'), [4])
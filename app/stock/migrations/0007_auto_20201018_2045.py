@@ -0,0 +1,21 @@
+# Generated by Django 2.2.9 on 2020-10-18 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0006_dataupdatehistory_initialdataupdatehistory'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='stockpricedailyhistory',
+            constraint=models.UniqueConstraint(fields=('company', 'price_date'), name='stock_price_daily_company_date_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='asxindexdailyhistory',
+            constraint=models.UniqueConstraint(fields=('index_name', 'index_date'), name='stock_index_daily_name_date_uniq'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.2.9 on 2020-10-19 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0007_auto_20201018_2045'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AsxIndexRollupHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index_name', models.CharField(max_length=128, verbose_name='Index Name')),
+                ('period', models.CharField(choices=[('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=16, verbose_name='Period')),
+                ('period_date', models.DateField()),
+                ('open_index', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('close_index', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('high_index', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('low_index', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('day_count', models.IntegerField(default=0, verbose_name='Trading days')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockPriceRollupHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=16, verbose_name='Period')),
+                ('period_date', models.DateField()),
+                ('open_price', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('close_price', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('high_price', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('low_price', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('volume', models.DecimalField(decimal_places=3, default=0, max_digits=19)),
+                ('day_count', models.IntegerField(default=0, verbose_name='Trading days')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_price_rollup_history', to='stock.Company')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='asxindexrolluphistory',
+            constraint=models.UniqueConstraint(fields=('index_name', 'period', 'period_date'), name='stock_index_rollup_name_period_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockpricerolluphistory',
+            constraint=models.UniqueConstraint(fields=('company', 'period', 'period_date'), name='stock_price_rollup_company_period_uniq'),
+        ),
+    ]
@@ -82,6 +82,10 @@ class StockPriceDailyHistory(BaseRecord):
 
     class Meta:
         app_label = "stock"
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'price_date'],
+                                    name='stock_price_daily_company_date_uniq'),
+        ]
 
 
 class StockPriceHistory(BaseRecord):
@@ -120,6 +124,61 @@ class AsxIndexDailyHistory(BaseRecord):
 
     class Meta:
         app_label = "stock"
+        constraints = [
+            models.UniqueConstraint(fields=['index_name', 'index_date'],
+                                    name='stock_index_daily_name_date_uniq'),
+        ]
+
+
+ROLLUP_PERIOD_CHOICES = (
+    ('weekly', 'Weekly'),
+    ('monthly', 'Monthly'),
+)
+
+
+class StockPriceRollupHistory(models.Model):
+    # weekly/monthly candles of StockPriceDailyHistory, maintained by the ingestion scripts,
+    # period_date is the monday of the week or the first day of the month
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name="stock_price_rollup_history")
+    period = models.CharField('Period', max_length=16, choices=ROLLUP_PERIOD_CHOICES)
+    period_date = models.DateField()
+    open_price = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    close_price = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    high_price = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    low_price = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    volume = models.DecimalField(max_digits=19, decimal_places=3, default=0)
+    day_count = models.IntegerField('Trading days', default=0)
+
+    def __str__(self):
+        return '{}-{}-{}'.format(self.company_id, self.period, self.period_date)
+
+    class Meta:
+        app_label = "stock"
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'period', 'period_date'],
+                                    name='stock_price_rollup_company_period_uniq'),
+        ]
+
+
+class AsxIndexRollupHistory(models.Model):
+    index_name = models.CharField('Index Name', max_length=128)
+    period = models.CharField('Period', max_length=16, choices=ROLLUP_PERIOD_CHOICES)
+    period_date = models.DateField()
+    open_index = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    close_index = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    high_index = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    low_index = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    day_count = models.IntegerField('Trading days', default=0)
+
+    def __str__(self):
+        return '{}-{}-{}'.format(self.index_name, self.period, self.period_date)
+
+    class Meta:
+        app_label = "stock"
+        constraints = [
+            models.UniqueConstraint(fields=['index_name', 'period', 'period_date'],
+                                    name='stock_index_rollup_name_period_uniq'),
+        ]
 
 
 class AsxIndexHistory(BaseRecord):
@@ -0,0 +1,61 @@
+import pathlib
+import sqlite3
+import threading
+
+# kept out of asx_gym.envs so the dashboard can use it without loading the env
+
+READER_MMAP_SIZE = 256 * 1024 * 1024
+# negative cache size is in KiB
+READER_CACHE_SIZE = -64 * 1024
+WRITER_CACHE_SIZE = -64 * 1024
+BUSY_TIMEOUT_MS = 30000
+
+
+def connect_reader(db_file, check_same_thread=True):
+    uri = f'{pathlib.Path(db_file).absolute().as_uri()}?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={READER_MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size={READER_CACHE_SIZE}')
+    conn.execute('PRAGMA query_only=1')
+    return conn
+
+
+def connect_writer(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    # journal mode is persistent in the file, in WAL readers are not blocked by the writer
+    conn.execute('PRAGMA journal_mode=WAL')
+    # durable in WAL mode up to the last checkpoint, much fewer fsyncs
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size={WRITER_CACHE_SIZE}')
+    return conn
+
+
+class ReadConnectionPool:
+    # one read only connection per thread and database file, the journal mode
+    # is left to the writer (connect_writer switches the file to WAL)
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, db_file):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        conn = connections.get(db_file)
+        if conn is None:
+            conn = connections[db_file] = connect_reader(db_file)
+        return conn
+
+    def close(self):
+        connections = getattr(self.local, 'connections', {})
+        for conn in connections.values():
+            conn.close()
+        connections.clear()
+
+
+read_connection_pool = ReadConnectionPool()
+
+
+def get_read_connection(db_file):
+    return read_connection_pool.get(db_file)
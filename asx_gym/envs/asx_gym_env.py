@@ -2,7 +2,6 @@ import io
 import json
 import pathlib
 import random
-import sqlite3
 from datetime import datetime, timedelta
 
 import cv2
@@ -19,16 +18,24 @@ from gym import spaces, logger
 from gym.utils import seeding
 from gym.utils.colorize import *
 
+from ..database import connect_reader
 from .asx_image_viewer import AsxImageViewer
 from .constants import TOP_UP_FUND, WITHDRAW_FUND, \
     BUY_STOCK, SELL_STOCK, MINIMUM_SIMULATION_DAYS, \
     MIN_STOCK_DATE, DB_FILE_NAME, RANDOM_START_DAYS_PERIOD, \
     DEFAULT_INITIAL_FUND, date_fmt, TRANSACTION_START_HOUR, TRANSACTION_END_HOUR, \
     RENDER_DEFAULT_DISPLAY_DAYS, DEFAULT_EXPECTED_FUND_INCREASE_RATIO, \
-    DEFAULT_EXPECTED_FUND_DECREASE_RATIO, MAX_PRICE_VALUE
+    DEFAULT_EXPECTED_FUND_DECREASE_RATIO, MAX_PRICE_VALUE, \
+    DAILY_SIMULATION_FILE_NAME, TEMPLATE_LIBRARY_DIRECTORY_NAME, DEFAULT_TEMPLATE_CACHE_BYTES, \
+    DEFAULT_TEMPLATE_RATIO_TOLERANCE, DAILY_STEP_COUNT, GRANULARITY_INTRADAY, GRANULARITY_DAILY, \
+    ASX_INDEX_NAMES, HISTORY_FIELDS
 
 from .models import StockDailySimulationPrices, StockRecord, \
     AsxAction, AsxObservation, TransactionFee
+from .execution import BrokerageFeeTable, match_orders
+from .statistics import EpisodeStatistics
+from .serializers import HistoryWriter, FORMAT_JSON, FORMAT_BINARY
+from .simulation_templates import SimulationTemplateLibrary, bridgeable, generate_bridge_prices
 from .utils import create_directory_if_not_exist
 
 
@@ -76,6 +83,7 @@ class AsxGymEnv(Env):
         self.keep_same_start_date_when_reset = kwargs.get('keep_same_start_date_when_reset', False)
         self.simulate_company_number = kwargs.get('simulate_company_number', -1)
         self.simulate_company_list = kwargs.get('simulate_company_list', None)
+        self.include_market_indexes = kwargs.get('include_market_indexes', False)
 
         self.initial_fund = kwargs.get('initial_fund', DEFAULT_INITIAL_FUND)
         self.initial_bank_balance = kwargs.get('initial_bank_balance', 0)
@@ -85,13 +93,23 @@ class AsxGymEnv(Env):
         self.expected_fund_decrease_ratio = kwargs.get('expected_fund_decrease_ratio',
                                                        DEFAULT_EXPECTED_FUND_DECREASE_RATIO)
         transaction_fee_list = kwargs.get('transaction_fee_list', [])
+        self.template_cache_bytes = kwargs.get('template_cache_bytes', DEFAULT_TEMPLATE_CACHE_BYTES)
+        self.template_ratio_tolerance = kwargs.get('template_ratio_tolerance',
+                                                   DEFAULT_TEMPLATE_RATIO_TOLERANCE)
+        self.synthetic_simulation = kwargs.get('synthetic_simulation', True)
+        self.granularity = kwargs.get('granularity', GRANULARITY_INTRADAY)
+        if self.granularity not in (GRANULARITY_INTRADAY, GRANULARITY_DAILY):
+            raise ValueError(f'Unknown granularity:{self.granularity}')
+        self.stock_figure_stale = False
 
         self.transaction_fee = []
         self._init_transaction_fee(transaction_fee_list)
 
         self.total_value_history_file = None
         self.save_figure = True
-        self.save_episode_history = False
+        self.save_episode_history = kwargs.get('save_episode_history', False)
+        self.history_format = kwargs.get('history_format', FORMAT_JSON)
+        self.history_writer = None
 
         # stock transaction and simulation data
         self.max_transaction_days = 0
@@ -103,61 +121,7 @@ class AsxGymEnv(Env):
         self.brokerage_fee = 0
         self.portfolios = {}
         self.info = {}
-        self.summaries = {
-            "episode": 0,
-            "steps": 0,
-            "available_fund": 0,
-            "state_date": "2020-01-01",
-            "end_date": "2020-01-01",
-            "indexes": {
-                "open": {
-                    "date": "2020-01-01",
-                    "index": 0,
-                },
-                "close": {
-                    "date": "2020-01-01",
-                    "index": 0,
-                },
-                "high": {
-                    "date": "2020-01-01",
-                    "index": 0,
-                },
-                "low": {
-                    "date": "2020-01-01",
-                    "index": MAX_PRICE_VALUE,
-                }
-            },
-            "values": {
-                "open": {
-                    "date": "2020-01-01",
-                    "value": 0,
-                },
-                "close": {
-                    "date": "2020-01-01",
-                    "value": 0,
-                },
-                "high": {
-                    "date": "2020-01-01",
-                    "value": 0,
-                },
-                "low": {
-                    "date": "2020-01-01",
-                    "value": MAX_PRICE_VALUE,
-                }
-            },
-            "transactions": {
-                'brokerage_fee': 0,
-                "buy": {
-                    "total": 0,
-                    "fulfilled": 0,
-                },
-                "sell": {
-                    "total": 0,
-                    "fulfilled": 0,
-                },
-            }
-
-        }
+        self.statistics = EpisodeStatistics()
         self.action = None
         self.directory_name = None
         self.reward = 0
@@ -185,12 +149,25 @@ class AsxGymEnv(Env):
             "price": np.array([0.0] * self.max_company_number),
         }
         self.daily_simulation_prices = {}
+        self.simulation_seq = 0
+        self.history_panel = None
+        self.history_company_ids = None
+        # current prices indexed by company id, for batched order matching
+        self.company_ask_prices = np.zeros(self.max_company_number)
+        self.company_bid_prices = np.zeros(self.max_company_number)
+        self.company_prices = np.zeros(self.max_company_number)
+        self.company_tradable = np.zeros(self.max_company_number, dtype=bool)
+        self.company_info = {}
 
         # action and observation spaces
         self._init_spaces()
 
         # loading data from database
         self._load_stock_data()
+        if self.include_market_indexes:
+            self.observation_space.spaces['market_indexes'] = spaces.Box(
+                low=np.float32(0), high=np.float32(self.number_infinite),
+                shape=(len(self.market_index_names), 4), dtype=np.float32)
         self.seed()
         if self.save_figure:
             create_directory_if_not_exist('images')
@@ -199,6 +176,10 @@ class AsxGymEnv(Env):
 
         self.directory_name = f'{self.date_prefix}/episode_{str(self.episode).zfill(4)}'
 
+    @property
+    def summaries(self):
+        return self.statistics.to_summaries()
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
@@ -210,57 +191,100 @@ class AsxGymEnv(Env):
         display_date = self._get_current_display_date()
         if self.need_move_day_forward:
             self._move_day_forward()
-        assert self.action_space.contains(action), "%r (%s) invalid" % (action, type(action))
+        asx_action = self._to_asx_action(action)
         # noinspection PyTypeChecker
-        end_batch = self._apply_asx_action(action)
+        end_batch = self._apply_asx_action(asx_action)
         reward = self._calculate_reward()
 
         self._save_episode_history_data()
-        self._draw_stock()
+        self._update_stock_figure()
 
         self.global_step_count += 1
         done = self._is_done()
 
         if done:
-            if self.directory_name:
-                summary_file = open(f'{self.directory_name}/summary.json', 'w')
-                json.dump(self.summaries, summary_file, indent=2)
-                summary_file.close()
-
-            if self.total_value_history_file:
-                self.total_value_history_file.close()
-                self.total_value_history_file = None
-                return None, 0, True, {}
+            self._finish_episode()
+            return None, 0, True, {}
         else:
-            obs = self._get_current_obs()
-            self.step_minute_count += 1
-            self.step_count += 1
-            self.need_move_day_forward = self.step_minute_count > 24 or end_batch
+            obs = self._next_obs(display_date, end_batch)
+            self.info['statistics'] = self.statistics.to_json_obj()
+            return obs, reward, False, self.info
 
-            # update summary
-            self.summaries['steps'] = self.step_count
+    def step_n(self, action, n, until_day_end=None, return_values=False):
+        # apply the action once then hold for up to n - 1 more steps,
+        # stopping early at the end of the trading day or the episode.
+        # until_day_end defaults to True intraday and False in daily
+        # granularity, where every step ends a day and would stop after one.
+        if until_day_end is None:
+            until_day_end = self.granularity != GRANULARITY_DAILY
+        obs, total_reward, done, info = self.step(action)
+        values = [self.total_value]
+        step_count = 1
+        while (step_count < n) and not done:
+            if until_day_end and self.need_move_day_forward:
+                break
+            display_date = self._get_current_display_date()
+            if self.need_move_day_forward:
+                self._move_day_forward()
+            reward = self._calculate_reward()
+            self._save_history_total_value()
+            self.global_step_count += 1
+            step_count += 1
+            values.append(self.total_value)
+            done = self._is_done()
+            if done:
+                self._finish_episode()
+                obs, info = None, {}
+            else:
+                obs = self._next_obs(display_date, False)
+                total_reward += reward
+
+        if step_count > 1 and not done:
+            self._close_fig()
+            self._update_stock_figure()
+        if not done:
+            info['steps'] = step_count
+            info['statistics'] = self.statistics.to_json_obj()
+            if return_values:
+                info['values'] = np.array(values, dtype=np.float32)
+        return obs, total_reward, done, info
+
+    def _finish_episode(self):
+        if self.directory_name:
+            summary_file = open(f'{self.directory_name}/summary.json', 'w')
+            json.dump(self.summaries, summary_file, indent=2)
+            summary_file.close()
 
-            self.summaries['end_date'] = display_date
-            self.summaries['indexes']['close']['index'] = obs['indexes']['close'].item()
-            self.summaries['indexes']['close']['date'] = display_date
-            high_index = obs['indexes']['high'].item()
-            if self.summaries['indexes']['high']['index'] < high_index:
-                self.summaries['indexes']['high']['index'] = high_index
-                self.summaries['indexes']['high']['date'] = display_date
+        if self.total_value_history_file:
+            self.total_value_history_file.close()
+            self.total_value_history_file = None
+        if self.history_writer:
+            self.history_writer.close()
+            self.history_writer = None
 
-            low_index = obs['indexes']['low'].item()
-            if self.summaries['indexes']['low']['index'] > low_index:
-                self.summaries['indexes']['low']['index'] = low_index
-                self.summaries['indexes']['low']['date'] = display_date
+    def _next_obs(self, display_date, end_batch):
+        obs = self._get_current_obs()
+        self.step_count += 1
+        if self.granularity == GRANULARITY_DAILY:
+            self.need_move_day_forward = True
+        else:
+            self.step_minute_count += 1
+            self.need_move_day_forward = self.step_minute_count > DAILY_STEP_COUNT or end_batch
 
-            return obs, reward, False, self.info
+        # update summary
+        self.statistics.steps = self.step_count
+        self.statistics.update_index(display_date, obs['indexes']['close'].item(),
+                                     obs['indexes']['high'].item(),
+                                     obs['indexes']['low'].item())
+
+        return obs
 
     def reset(self):
         self._close_fig()
         self.episode += 1
 
         self.step_day_count = 0
-        self.step_minute_count = 0
+        self.step_minute_count = self._get_first_step_minute_count()
         self.step_count = 0
         self.available_fund = self.initial_fund
         self.previous_total_fund = self.available_fund
@@ -287,7 +311,7 @@ class AsxGymEnv(Env):
                 self.simulate_company_list = company_list[:self.simulate_company_number]
 
         self._generate_daily_simulation_price_for_companies(current_date=display_date)
-        self._draw_stock()
+        self._update_stock_figure()
 
         self.index_df.loc[:, "Volume"] = round(self.initial_fund, 1)
 
@@ -295,36 +319,43 @@ class AsxGymEnv(Env):
 
         obs = self._get_current_obs()
         # update summary
-        self.summaries['episode'] = self.episode
-        self.summaries['steps'] = self.step_count
-        self.summaries['state_date'] = display_date
-        self.summaries['end_date'] = display_date
-        self.summaries['indexes']['open']['index'] = obs['indexes']['open'].item()
-        self.summaries['indexes']['open']['date'] = display_date
-        self.summaries['indexes']['close']['index'] = obs['indexes']['close'].item()
-        self.summaries['indexes']['close']['date'] = display_date
-        self.summaries['indexes']['high']['index'] = obs['indexes']['high'].item()
-        self.summaries['indexes']['high']['date'] = display_date
-        self.summaries['indexes']['low']['index'] = obs['indexes']['low'].item()
-        self.summaries['indexes']['low']['date'] = display_date
-        self.summaries['values']['open']['value'] = self.available_fund
-        self.summaries['values']['open']['date'] = display_date
-        self.summaries['values']['close']['value'] = self.available_fund
-        self.summaries['values']['close']['date'] = display_date
-        self.summaries['values']['high']['value'] = self.available_fund
-        self.summaries['values']['high']['date'] = display_date
-        self.summaries['values']['low']['value'] = self.available_fund
-        self.summaries['values']['low']['date'] = display_date
-
-        # noinspection PyTypeChecker
-        self.summaries['transactions']['brokerage_fee'] = 0
-        self.summaries['transactions']['buy']['total'] = 0
-        self.summaries['transactions']['buy']['fulfilled'] = 0
-        self.summaries['transactions']['sell']['total'] = 0
-        self.summaries['transactions']['sell']['fulfilled'] = 0
+        self.statistics.reset(self.episode, display_date, self.available_fund,
+                              obs['indexes']['open'].item(), obs['indexes']['close'].item(),
+                              obs['indexes']['high'].item(), obs['indexes']['low'].item())
 
         return obs
 
+    def history(self, window, fields=HISTORY_FIELDS):
+        # Daily prices of the last `window` trading days as (days, companies) views
+        # of a dense panel, columns follow env.history_company_ids and days without
+        # trading are nan. Only completed days are visible intraday, the current
+        # day is included in daily granularity where its close is observed.
+        if self.history_panel is None:
+            self._load_history_panel()
+        end = self.simulation_seq
+        if self.granularity == GRANULARITY_DAILY:
+            end += 1
+        start = max(end - window, 0)
+        if isinstance(fields, str):
+            return self.history_panel[HISTORY_FIELDS.index(fields), start:end]
+        return {field: self.history_panel[HISTORY_FIELDS.index(field), start:end]
+                for field in fields}
+
+    def _load_history_panel(self):
+        price_df = self.price_df.reset_index()
+        if self.simulate_company_list:
+            price_df = price_df[price_df.company_id.isin(self.simulate_company_list)]
+            self.history_company_ids = np.array(sorted(set(self.simulate_company_list)))
+        else:
+            self.history_company_ids = np.sort(price_df.company_id.unique())
+        columns = [f'{field}_price' for field in HISTORY_FIELDS]
+        panel_df = price_df.pivot_table(index='price_date', columns='company_id',
+                                        values=columns, aggfunc='last')
+        panel_df = panel_df.reindex(self.index_df.index)
+        self.history_panel = np.ascontiguousarray(np.stack(
+            [panel_df[column].reindex(columns=self.history_company_ids).to_numpy()
+             for column in columns]).astype(np.float32))
+
     def insert_summary_images(self, repeats=5):
         for _ in range(repeats):
             self._draw_summary()
@@ -335,6 +366,9 @@ class AsxGymEnv(Env):
         if mode == 'ansi':
             self._render_ansi()
         else:
+            if self.stock_figure_stale:
+                self._close_fig()
+                self._draw_stock()
             img = self._get_img_from_fig(self.fig)
             if mode == 'rgb_array':
                 return img
@@ -371,8 +405,7 @@ class AsxGymEnv(Env):
 
             print(colorize(f'Stock List Prices', color='red'))
             for company_id, prices in asx_observation.prices.items():
-                company = self.company_df[self.company_df.id == company_id]
-                company_name = company.iloc[0, 1]
+                company_name = self._get_company_info(company_id)['name']
 
                 ask_price = round(prices.ask_price, 2)
                 bid_price = round(prices.bid_price, 2)
@@ -383,9 +416,7 @@ class AsxGymEnv(Env):
             print(colorize('_' * 60, color='blue'))
             print(colorize(f'Portfolios', color='red'))
             for stock_record in asx_observation.portfolios:
-                company_id = stock_record.company_id
-                company = self.company_df[self.company_df.id == company_id]
-                company_name = company.iloc[0, 1]
+                company_name = self._get_company_info(stock_record.company_id)['name']
                 price = round(stock_record.price, 2)
                 volume = round(stock_record.volume, 2)
                 print(colorize(f'  Company:{company_name}', color='blue'))
@@ -397,17 +428,27 @@ class AsxGymEnv(Env):
         for (amount, fee, is_percentage) in transaction_fee_list:
             transaction_fee = TransactionFee(amount, fee, is_percentage)
             self.transaction_fee.append(transaction_fee)
+        self.brokerage_fee_table = BrokerageFeeTable(self.transaction_fee)
 
     def _init_episode_storage(self):
         if self.total_value_history_file:
             self.total_value_history_file.close()
+        if self.history_writer:
+            self.history_writer.close()
+            self.history_writer = None
         self.directory_name = f'{self.date_prefix}/episode_{str(self.episode).zfill(4)}'
         create_directory_if_not_exist(self.directory_name)
         self.total_value_history_file = open(f'{self.directory_name}/history_values.csv', 'w')
 
+    def _get_first_step_minute_count(self):
+        # daily steps are taken at the close
+        if self.granularity == GRANULARITY_DAILY:
+            return DAILY_STEP_COUNT
+        return 0
+
     def _move_day_forward(self):
         self.step_day_count += 1
-        self.step_minute_count = 0
+        self.step_minute_count = self._get_first_step_minute_count()
         display_date = self.display_date
         if display_date:
             self._generate_daily_simulation_price_for_companies(current_date=display_date)
@@ -543,16 +584,13 @@ class AsxGymEnv(Env):
                 stock_record.price = price
             self.available_fund -= (total_amount + brokerage_fee)
             self.brokerage_fee += brokerage_fee
-            # noinspection PyTypeChecker
-            self.summaries['transactions']['brokerage_fee'] = round(self.brokerage_fee, 2)
-
             fulfilled = True
 
         # update summary
-        self.summaries['transactions']['buy']['total'] += 1
-
         if fulfilled:
-            self.summaries['transactions']['buy']['fulfilled'] += 1
+            self.statistics.record_buy(True, total_amount, brokerage_fee)
+        else:
+            self.statistics.record_buy(False)
         return fulfilled
 
     def _sell_stock(self, company_id, price, volume):
@@ -562,6 +600,7 @@ class AsxGymEnv(Env):
         if stock_record is not None:
             if stock_record.volume >= volume:
                 total_amount = round(volume * price, 3)
+                profitable = price > stock_record.buy_price
                 stock_record.volume -= volume
                 stock_record.sell_price = price
                 stock_record.price = price
@@ -569,14 +608,12 @@ class AsxGymEnv(Env):
                 brokerage_fee = self._calculate_brokerage_fee(total_amount)
                 self.available_fund += total_amount - brokerage_fee
                 self.brokerage_fee += brokerage_fee
-                # noinspection PyTypeChecker
-                self.summaries['transactions']['brokerage_fee'] = round(self.brokerage_fee, 2)
                 fulfilled = True
+                # update summary
+                self.statistics.record_sell(True, total_amount, brokerage_fee, profitable)
 
-        # update summary
-        self.summaries['transactions']['sell']['total'] += 1
-        if fulfilled:
-            self.summaries['transactions']['sell']['fulfilled'] += 1
+        if not fulfilled:
+            self.statistics.record_sell(False)
         return fulfilled
 
     def _is_done(self):
@@ -595,62 +632,116 @@ class AsxGymEnv(Env):
 
         return done
 
-    def _apply_asx_action(self, action):
-        fulfilled = False
+    def _get_company_info(self, company_id):
+        key = str(company_id)
+        company_info = self.company_info.get(key, None)
+        if company_info is None:
+            company = self.company_df[self.company_df.id == company_id]
+            company_info = {
+                'name': company.iloc[0, 1],
+                'description': company.iloc[0, 2]
+            }
+            sector_id = company.iloc[0, 4]
+            if sector_id and not np.isnan(sector_id):
+                sector_id = int(sector_id)
+                sector = self.sector_df[self.sector_df.id == sector_id]
+                if len(sector) > 0:
+                    company_info['sector'] = sector.iloc[0, 2]
+            self.company_info[key] = company_info
+        return company_info
+
+    def _to_asx_action(self, action):
+        if isinstance(action, (AsxAction, np.ndarray)):
+            asx_action = AsxAction.from_env_action(action)
+            orders = asx_action.orders
+            assert len(orders) <= self.max_company_number \
+                   and np.all((orders['company_id'] >= 0)
+                              & (orders['company_id'] < self.max_company_number)) \
+                   and np.all((orders['stock_operation'] >= 0) & (orders['stock_operation'] < 5)) \
+                   and np.all((orders['volume'] >= 0) & (orders['price'] >= 0)), \
+                "%r (%s) invalid" % (action, type(action))
+            return asx_action
+        assert self.action_space.contains(action), "%r (%s) invalid" % (action, type(action))
+        return AsxAction.from_env_action(action)
+
+    def _apply_asx_action(self, asx_action: AsxAction):
         self.info["transactions"] = {}
         self.info["companies"] = {}
-        company_count = action['company_count']
-        end_batch = action['end_batch']
-        self.action = action
-        for i in range(company_count):
-            stock_operation = action['stock_operation'][i]
-            company_id = action['company_id'][i]
-            price = float(action['price'][i])
-            volume = float(action['volume'][i])
+        end_batch = asx_action.end_batch
+        self.action = asx_action
+        orders = asx_action.orders
+        stock_operations = orders['stock_operation']
+        company_ids = orders['company_id'].astype(np.int64)
+        prices = orders['price'].astype(np.float64)
+        volumes = orders['volume'].astype(np.float64)
+
+        holdings = np.zeros(self.max_company_number)
+        for stock_record in self.portfolios.values():
+            holdings[int(stock_record.company_id)] = stock_record.volume
+
+        execution = match_orders(stock_operations, company_ids, prices, volumes,
+                                 self.company_ask_prices[company_ids],
+                                 self.company_bid_prices[company_ids],
+                                 holdings[company_ids],
+                                 self.company_tradable[company_ids],
+                                 self.available_fund, self.brokerage_fee_table)
+        self.available_fund = execution.available_fund
+
+        for i in np.flatnonzero(execution.sell_fulfilled):
+            stock_record: StockRecord = self.portfolios[str(company_ids[i])]
+            price = execution.execution_prices[i]
+            self.statistics.record_sell(True, execution.amounts[i], execution.fees[i],
+                                        price > stock_record.buy_price)
+            stock_record.volume -= volumes[i]
+            stock_record.sell_price = price
+            stock_record.price = price
+        for i in np.flatnonzero(execution.buy_fulfilled):
+            key = str(company_ids[i])
+            price = execution.execution_prices[i]
+            stock_record: StockRecord = self.portfolios.get(key, None)
+            if stock_record is None:
+                self.portfolios[key] = StockRecord(company_ids[i], volumes[i], price, 0, price)
+            else:
+                stock_record.volume += volumes[i]
+                stock_record.buy_price = price
+                stock_record.price = price
+            self.statistics.record_buy(True, execution.amounts[i], execution.fees[i])
+        self.brokerage_fee += execution.fees.sum()
+        for _ in range(np.count_nonzero(execution.sell_orders & ~execution.sell_fulfilled)):
+            self.statistics.record_sell(False)
+        sized_buys = execution.buy_orders & ~execution.buy_all_orders
+        for _ in range(np.count_nonzero(sized_buys & ~execution.buy_fulfilled)):
+            self.statistics.record_buy(False)
+        # buying with all available fund depends on the fund left by the other orders
+        for i in np.flatnonzero(execution.buy_all_orders):
+            execution.buy_fulfilled[i] = self._buy_stock(company_ids[i],
+                                                         execution.execution_prices[i], volumes[i])
+
+        for i in np.flatnonzero(self.company_tradable[company_ids]):
+            stock_operation = stock_operations[i]
+            company_id = company_ids[i]
             key = str(company_id)
-
-            if (key in self.daily_simulation_data) and \
-                    (key in self.daily_simulation_prices):
-                company = self.company_df[self.company_df.id == company_id]
-                company_name = company.iloc[0, 1]
-                company_description = company.iloc[0, 2]
-                self.info["companies"][key] = {
-                    'name': company_name,
-                    'description': company_description
-                }
-                sector_id = company.iloc[0, 4]
-                if sector_id and not np.math.isnan(sector_id):
-                    sector_id = int(sector_id)
-                    sector = self.sector_df[self.sector_df.id == sector_id]
-                    if len(sector) > 0:
-                        sector_name = sector.iloc[0, 2]
-                        self.info["companies"][key]['sector'] = sector_name
-
-                ask_price = self.daily_simulation_prices[key]['ask_price']
-                bid_price = self.daily_simulation_prices[key]['bid_price']
-                current_price = self.daily_simulation_prices[key]['price']
-                if stock_operation == BUY_STOCK and price >= ask_price:  # buy
-                    fulfilled = self._buy_stock(company_id, ask_price, volume)
-                    self.info["transactions"][key] = {'action': 'buy',
-                                                      'price': bid_price,
-                                                      'volume': volume,
-                                                      'fulfilled': fulfilled}
-                elif stock_operation == SELL_STOCK and price <= bid_price:  # sell
-                    fulfilled = self._sell_stock(company_id, bid_price, volume)
-                    self.info["transactions"][key] = {'action': 'sell',
-                                                      'price': bid_price,
-                                                      'volume': volume,
-                                                      'fulfilled': fulfilled}
-                elif stock_operation == TOP_UP_FUND:
-                    pass
-                elif stock_operation == WITHDRAW_FUND:
-                    pass
-                else:
-                    self.info["transactions"][key] = {'action': 'hold',
-                                                      'price': current_price,
-                                                      'volume': -1,
-                                                      'fulfilled': fulfilled
-                                                      }
+            self.info["companies"][key] = self._get_company_info(company_id)
+            if execution.buy_orders[i]:
+                self.info["transactions"][key] = {'action': 'buy',
+                                                  'price': self.company_bid_prices[company_id],
+                                                  'volume': volumes[i],
+                                                  'fulfilled': bool(execution.buy_fulfilled[i])}
+            elif execution.sell_orders[i]:
+                self.info["transactions"][key] = {'action': 'sell',
+                                                  'price': self.company_bid_prices[company_id],
+                                                  'volume': volumes[i],
+                                                  'fulfilled': bool(execution.sell_fulfilled[i])}
+            elif stock_operation == TOP_UP_FUND:
+                pass
+            elif stock_operation == WITHDRAW_FUND:
+                pass
+            else:
+                self.info["transactions"][key] = {'action': 'hold',
+                                                  'price': self.company_prices[company_id],
+                                                  'volume': -1,
+                                                  'fulfilled': False
+                                                  }
 
         return end_batch
 
@@ -666,11 +757,12 @@ class AsxGymEnv(Env):
             current_price = self._get_current_price_for_company(key, stock_record.price)
             total_amount += stock_record.volume * current_price
 
-        self.summaries['available_fund'] = round(self.available_fund, 2)
+        self.statistics.available_fund = self.available_fund
         return round(total_amount, 2)
 
     def _get_asx_prices(self):
         count = 0
+        self.company_tradable[:] = False
         for key, simulations in self.daily_simulation_data.items():
             self.env_prices['company_id'][count] = simulations.company_id
             prices = simulations.get_next_prices()
@@ -686,6 +778,11 @@ class AsxGymEnv(Env):
             }
 
             count += 1
+        company_ids = self.env_prices['company_id'][:count]
+        self.company_ask_prices[company_ids] = self.env_prices['ask_price'][:count]
+        self.company_bid_prices[company_ids] = self.env_prices['bid_price'][:count]
+        self.company_prices[company_ids] = self.env_prices['price'][:count]
+        self.company_tradable[company_ids] = True
         return self.env_prices
 
     def _get_asx_portfolios(self):
@@ -726,9 +823,18 @@ class AsxGymEnv(Env):
 
     def _save_episode_history_data(self):
         self._save_history_total_value()
-        if self.save_episode_history and self.directory_name and self.action and self.observation:
+        if self.save_episode_history and self.directory_name and (self.action is not None) and self.observation \
+                and self.history_format != FORMAT_JSON:
+            if self.history_writer is None:
+                extension = 'bin' if self.history_format == FORMAT_BINARY else 'ndjson'
+                self.history_writer = HistoryWriter(f'{self.directory_name}/history.{extension}',
+                                                    self.history_format)
+            self.history_writer.write(self.observation, self.action, self.reward,
+                                      {'date_time': self.current_display_date_time,
+                                       'transactions': self.info.get('transactions', {})})
+        elif self.save_episode_history and self.directory_name and (self.action is not None) and self.observation:
             episode_history_file = open(f'{self.directory_name}/step_{str(self.step_count).zfill(6)}.json', 'w')
-            asx_action = AsxAction.from_env_action(self.action)
+            asx_action = self.action
             asx_observation = AsxObservation(self.observation)
             episode = {
                 'date_time': self.current_display_date_time,
@@ -755,7 +861,16 @@ class AsxGymEnv(Env):
                 self.total_value_history_file.write(f'{self.current_display_date_time},'
                                                     f'{total_fund}\n')
 
+    def _update_stock_figure(self):
+        # in daily granularity the chart redraw would dominate the step time,
+        # it is drawn on the next render instead
+        if self.granularity == GRANULARITY_DAILY:
+            self.stock_figure_stale = True
+        else:
+            self._draw_stock()
+
     def _draw_stock(self):
+        self.stock_figure_stale = False
         display_date = self.display_date
         if display_date:
             stock_index = self.index_df.iloc[
@@ -797,6 +912,7 @@ class AsxGymEnv(Env):
         else:
             size = (11, 8)
         self._close_fig()
+        self.stock_figure_stale = False
         plt.style.use('seaborn-colorblind')
         summary = self.summaries
         dates = [summary['values']['open']['date'],
@@ -850,26 +966,14 @@ class AsxGymEnv(Env):
         self.reward = diff
 
         # update summary
-
-        high_value = self.summaries['values']['high']['value']
-        low_value = self.summaries['values']['low']['value']
-        display_date = self.display_date
-        if high_value < self.total_value:
-            self.summaries['values']['high']['value'] = total_fund
-            self.summaries['values']['high']['date'] = display_date
-        if low_value > self.total_value:
-            self.summaries['values']['low']['value'] = total_fund
-            self.summaries['values']['low']['date'] = display_date
-
-        self.summaries['values']['close']['value'] = total_fund
-        self.summaries['values']['close']['date'] = display_date
+        self.statistics.update_value(self.display_date, total_fund)
 
         return diff
 
     def _load_stock_data(self):
         print(colorize("Initializing data, it may take a couple minutes,please wait...", 'red'))
         db_file = f'{pathlib.Path().absolute()}/asx_gym/{DB_FILE_NAME}'
-        conn = sqlite3.connect(db_file)
+        conn = connect_reader(db_file)
         cur = conn.cursor()
         cur.execute("SELECT min(updated_date) as updated_date from stock_dataupdatehistory")
         updated_date = cur.fetchone()
@@ -907,6 +1011,7 @@ class AsxGymEnv(Env):
         init_seq = self.index_df[self.index_df.index == '2011-01-10']
         self.min_stock_seq = init_seq.Seq[0]
         print(f'Asx index records:\n{self.index_df.count()}')
+        self._load_market_indexes(conn)
         print(colorize("reading asx company data", 'blue'))
         self.company_df = pd.read_sql_query('SELECT id,name,description,code,sector_id '
                                             'FROM stock_company', conn)
@@ -931,22 +1036,43 @@ class AsxGymEnv(Env):
         print(f'Asx stock data records:\n{self.price_df.count()}')
         conn.close()
         print(colorize("Loading stock price simulation data", 'blue'))
-        daily_simulation_file = f'{pathlib.Path().absolute()}/asx_gym/daily_stock_price.csv'
-        self.daily_simulation_df = pd.read_csv(daily_simulation_file)
-        self.daily_simulation_df.columns = ['cid', 'day', 'seconds', 'normalized_ask_price',
-                                            'normalized_bid_price',
-                                            'normalized_stock_price', 'normalized_low_price',
-                                            'normalized_high_price']
-        self.daily_simulation_df = self.daily_simulation_df.set_index(['cid', 'day'])
+        data_directory = f'{pathlib.Path().absolute()}/asx_gym'
+        self.simulation_templates = SimulationTemplateLibrary.load_or_build(
+            f'{data_directory}/{TEMPLATE_LIBRARY_DIRECTORY_NAME}',
+            f'{data_directory}/{DAILY_SIMULATION_FILE_NAME}',
+            cache_bytes=self.template_cache_bytes)
+        print(f'Simulation templates:{self.simulation_templates.template_count}')
         self.min_company_id = 0
-        self.max_company_id = max((self.daily_simulation_df.index.get_level_values('cid')))
+        self.max_company_id = self.simulation_templates.max_company_id
 
         self.daily_simulation_data = {}
-        self.cached_simulation_records = {}
         print(colorize("Data initialized", "green"))
 
+    def _load_market_indexes(self, conn):
+        # all indexes aligned to the ALL ORD trading calendar: (days, indexes, [open, close, high, low])
+        print(colorize("Loading asx market indexes", 'blue'))
+        market_df = pd.read_sql_query(
+            'SELECT index_name,index_date,open_index,close_index,high_index,low_index '
+            'FROM stock_asxindexdailyhistory',
+            conn, parse_dates={'index_date': date_fmt})
+        available_names = set(market_df.index_name.unique())
+        self.market_index_names = [name for name in ASX_INDEX_NAMES if name in available_names] \
+            + sorted(available_names - set(ASX_INDEX_NAMES))
+        fields = ['open_index', 'close_index', 'high_index', 'low_index']
+        market_df = market_df.pivot_table(index='index_date', columns='index_name',
+                                          values=fields, aggfunc='last')
+        market_df = market_df.reindex(self.index_df.index).ffill()
+        self.market_index_matrix = np.ascontiguousarray(np.nan_to_num(np.stack(
+            [market_df[field].reindex(columns=self.market_index_names).to_numpy()
+             for field in fields], axis=2)).astype(np.float32))
+        # observations are views of this matrix, shared by every episode
+        self.market_index_matrix.flags.writeable = False
+        print(f'Asx market indexes:{self.market_index_names}')
+
     @staticmethod
     def normalized_price(high_price, price):
+        if not high_price > 0:
+            return float('nan')
         return round(price / high_price, 3)
 
     def _get_current_obs(self):
@@ -973,6 +1099,9 @@ class AsxGymEnv(Env):
             "portfolios": self._get_asx_portfolios()
 
         }
+        if self.include_market_indexes:
+            # a read only view of the day's row, no copy
+            obs["market_indexes"] = self.market_index_matrix[self.min_stock_seq + self.step_day_count]
         self.observation = obs
         return obs
 
@@ -981,49 +1110,57 @@ class AsxGymEnv(Env):
         simulations = StockDailySimulationPrices(company_id, open_price, close_price,
                                                  high_price, low_price)
         ratio = self.normalized_price(high_price, low_price)
-        key_ration = str(ratio)
-        if key_ration in self.cached_simulation_records:
-            selected_simulations = self.cached_simulation_records.get(key_ration)
-        else:
-            selected_simulations = self.daily_simulation_df[self.daily_simulation_df.normalized_low_price == ratio]
-            self.cached_simulation_records[key_ration] = selected_simulations
-        if len(selected_simulations) > 0:
-            numbers = selected_simulations.index.get_level_values('day').unique().to_list()
-            random.shuffle(numbers)
-            selected_day = numbers[0]
-            selected_simulations = selected_simulations.query(f'day=={selected_day}')
-            companies = selected_simulations.index.get_level_values('cid').unique().to_list()
-            random.shuffle(companies)
-            selected_company = companies[0]
-            selected_simulation_prices = selected_simulations.query(f'cid=={selected_company}').sort_values('seconds')[
-                                         :22]
-            prices = []
-            for index, (seconds, normalized_ask_price, normalized_bid_price,
-                        normalized_stock_price, normalized_low_price, normalized_high_price) \
-                    in selected_simulation_prices.iterrows():
-                prices.append((normalized_ask_price, normalized_bid_price,
-                               normalized_stock_price))
-
+        prices = self.simulation_templates.sample(ratio, self.template_ratio_tolerance)
+        if prices is not None:
             simulations.init_simulation_prices(prices)
-        else:
+        elif not self.synthetic_simulation:
             simulations.init_simulation_prices([])
         return simulations
 
+    def _generate_synthetic_simulation_prices(self, simulations_list):
+        # days without a usable high keep the flat fallback
+        valid = bridgeable([s.high_price for s in simulations_list],
+                           [s.low_price for s in simulations_list])
+        for simulations, is_valid in zip(simulations_list, valid):
+            if not is_valid:
+                simulations.init_simulation_prices([])
+        simulations_list = [s for s, is_valid in zip(simulations_list, valid) if is_valid]
+        if len(simulations_list) == 0:
+            return
+        logger.info(f'Generating synthetic simulation data for {len(simulations_list)} companies')
+        # same bid/ask spread as the company's recorded templates
+        spreads = np.array([self.simulation_templates.company_spread(int(s.company_id))
+                            for s in simulations_list]).reshape(-1, 2)
+        prices = generate_bridge_prices([s.open_price for s in simulations_list],
+                                        [s.close_price for s in simulations_list],
+                                        [s.high_price for s in simulations_list],
+                                        [s.low_price for s in simulations_list],
+                                        self.np_random,
+                                        ask_spreads=spreads[:, 0], bid_spreads=spreads[:, 1])
+        for simulations, simulation_prices in zip(simulations_list, prices):
+            simulations.init_simulation_prices(simulation_prices)
+
     def _get_company_count(self):
         return len(self.daily_simulation_data)
 
     def _generate_daily_simulation_price_for_companies(self, current_date):
+        self.simulation_seq = int(self.index_df.index.searchsorted(pd.Timestamp(current_date)))
         price_on_current_date_df = self.price_df.query(f'price_date=="{current_date}"')
         self.daily_simulation_data = {}
+        missing_simulations = []
 
-        self.cached_simulation_records = {}
         for (day, company_id), (open_price, close_price, high_price, low_price) \
                 in price_on_current_date_df.iterrows():
             need_simulate = True
             if self.simulate_company_list is not None:
                 if company_id not in self.simulate_company_list:
                     need_simulate = False
-            if need_simulate:
+            if need_simulate and self.granularity == GRANULARITY_DAILY:
+                simulations = StockDailySimulationPrices(company_id, open_price, close_price,
+                                                         high_price, low_price)
+                simulations.init_daily_prices()
+                self.daily_simulation_data[str(int(company_id))] = simulations
+            elif need_simulate:
                 company = self.company_df[self.company_df.id == company_id].iloc[0, 1]
                 logger.info(
                     f'Generating simulation data for company {colorize(company_id, "blue")}:'
@@ -1033,9 +1170,16 @@ class AsxGymEnv(Env):
                                                                                 high_price, low_price)
                 if simulations:
                     self.daily_simulation_data[str(int(simulations.company_id))] = simulations
+                    if not simulations.initialized:
+                        missing_simulations.append(simulations)
+        self._generate_synthetic_simulation_prices(missing_simulations)
+        simulated_companies = np.zeros(self.max_company_number, dtype=bool)
+        simulated_companies[[int(key) for key in self.daily_simulation_data]] = True
+        self.company_tradable &= simulated_companies
         logger.info(
             f'Generated simulation data on {colorize(current_date, "green")} '
             f'for {colorize(len(self.daily_simulation_data), "red")} companies')
+        logger.debug(f'Simulation template cache:{self.simulation_templates.cache.stats()}')
 
     def _get_img_from_fig(self, fig, dpi=160):
         buf = io.BytesIO()
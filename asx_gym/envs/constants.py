@@ -9,11 +9,17 @@ TOP_UP_FUND = 3
 WITHDRAW_FUND = 4
 MIN_STOCK_DATE = date(2010, 10, 10)
 DB_FILE_NAME = 'db.sqlite3'
+ASX_INDEX_NAMES = ['ALL ORD', 'ASX20', 'ASX50', 'ASX100', 'ASX200', 'ASX300']
+HISTORY_FIELDS = ('open', 'close', 'high', 'low')
+FRAME_FIELDS = ('ask_price', 'bid_price', 'price', 'volume')
 MINIMUM_SIMULATION_DAYS = 50
 RANDOM_START_DAYS_PERIOD = 100
 DEFAULT_INITIAL_FUND = 100000
 TRANSACTION_START_HOUR = 10
 TRANSACTION_END_HOUR = 16
+DAILY_STEP_COUNT = 24  # 15 min steps from 10:00 to 16:00
+GRANULARITY_INTRADAY = 'intraday'
+GRANULARITY_DAILY = 'daily'
 RENDER_DEFAULT_DISPLAY_DAYS = 20
 DEFAULT_EXPECTED_FUND_INCREASE_RATIO = 2.0
 DEFAULT_EXPECTED_FUND_DECREASE_RATIO = 0.2
@@ -25,3 +31,13 @@ DEFAULT_BROKERAGE_FEE = [
     (25000, 29.95, False),
     (MAX_PRICE_VALUE, 0.12, True)
 ]
+
+# intraday simulation templates
+DAILY_SIMULATION_FILE_NAME = 'daily_stock_price.csv'
+TEMPLATE_LIBRARY_DIRECTORY_NAME = 'daily_stock_price'
+TEMPLATE_LIBRARY_VERSION = 1
+TEMPLATE_RATIO_BUCKETS = 1001  # low/high ratio rounded to 3 decimals
+TEMPLATE_PRICE_SCALE = 32768  # uint16 quantization, covers normalized prices in [0, 2)
+MAX_TEMPLATE_TICKS = 22
+DEFAULT_TEMPLATE_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_TEMPLATE_RATIO_TOLERANCE = 0.01
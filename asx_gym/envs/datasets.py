@@ -0,0 +1,272 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from .constants import FRAME_FIELDS
+from .models import ORDER_DTYPE
+from .utils import create_directory_if_not_exist
+
+DATASET_VERSION = 1
+DATASET_META_FILE_NAME = 'meta.json'
+
+STEP_DTYPE = np.dtype([('episode', np.int32),
+                       ('day', np.int32),
+                       ('second', np.int32),
+                       ('total_value', np.float64),
+                       ('available_fund', np.float64),
+                       ('bank_balance', np.float64),
+                       ('reward', np.float32),
+                       ('done', np.bool_),
+                       ('end_batch', np.int8),
+                       ('order_start', np.int64),
+                       ('order_count', np.int32)])
+EPISODE_DTYPE = np.dtype([('episode', np.int32),
+                          ('start', np.int64),
+                          ('length', np.int64)])
+
+
+class GrowableMemmap:
+    # append only memory mapped array, the file doubles when full and is
+    # trimmed to the rows written on close. With count > 0 the first count rows
+    # of an existing file are kept and appending resumes after them.
+    def __init__(self, file_name, dtype, row_shape=(), capacity=1024, count=0):
+        self.file_name = file_name
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        self.count = count
+        self.capacity = 0
+        self.array = None
+        if count == 0:
+            open(file_name, 'wb').close()
+        elif not os.path.exists(file_name) or os.path.getsize(file_name) < count * self.row_bytes:
+            raise ValueError(f'{file_name} has less than the {count} recorded rows')
+        self._resize(max(capacity, count))
+
+    def _resize(self, capacity):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(capacity * self.row_bytes)
+        self.array = np.memmap(self.file_name, dtype=self.dtype, mode='r+',
+                               shape=(capacity,) + self.row_shape)
+        self.capacity = capacity
+
+    def extend(self, values):
+        size = len(values)
+        if self.count + size > self.capacity:
+            self._resize(max(self.capacity * 2, self.count + size))
+        self.array[self.count:self.count + size] = values
+        self.count += size
+
+    def append(self, value):
+        if self.count == self.capacity:
+            self._resize(self.capacity * 2)
+        self.array[self.count] = value
+        self.count += 1
+
+    def flush(self):
+        self.array.flush()
+
+    def close(self):
+        self.array.flush()
+        self.array = None
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(self.count * self.row_bytes)
+
+
+class TrajectoryShardWriter:
+    """
+    One shard of an offline dataset, a directory of raw binary files:
+    steps.bin (STEP_DTYPE), frames.bin (float32 steps x FRAME_FIELDS x universe),
+    orders.bin (ORDER_DTYPE) and episodes.bin (EPISODE_DTYPE), described by
+    meta.json. Each worker writes its own shard.
+
+    A shard that already has a meta.json is resumed: the episodes it records
+    are kept and new ones are appended, numbered after the last recorded one.
+    Steps of an episode that was not ended are discarded.
+    """
+
+    def __init__(self, directory, company_ids, capacity=4096):
+        create_directory_if_not_exist(directory)
+        self.directory = directory
+        self.company_ids = np.asarray(company_ids, dtype=np.int64)
+        counts = self._load_counts()
+        frame_shape = (len(FRAME_FIELDS), len(self.company_ids))
+        self.steps = GrowableMemmap(f'{directory}/steps.bin', STEP_DTYPE, (), capacity,
+                                    counts['step_count'])
+        self.frames = GrowableMemmap(f'{directory}/frames.bin', np.float32, frame_shape, capacity,
+                                     counts['step_count'])
+        self.orders = GrowableMemmap(f'{directory}/orders.bin', ORDER_DTYPE, (), capacity,
+                                     counts['order_count'])
+        self.episodes = GrowableMemmap(f'{directory}/episodes.bin', EPISODE_DTYPE, (), 64,
+                                       counts['episode_count'])
+        self.episode = None
+        self.episode_start = 0
+        self.episode_offset = 0
+        if self.episodes.count > 0:
+            self.episode_offset = int(self.episodes.array[self.episodes.count - 1]['episode'])
+
+    def _load_counts(self):
+        meta_file = f'{self.directory}/{DATASET_META_FILE_NAME}'
+        if not os.path.exists(meta_file):
+            return {'step_count': 0, 'order_count': 0, 'episode_count': 0}
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta['version'] != DATASET_VERSION or meta['frame_fields'] != list(FRAME_FIELDS) or \
+                meta['company_ids'] != self.company_ids.tolist():
+            raise ValueError(f'Shard {self.directory} was recorded with another layout or universe')
+        if meta['episode_count'] == 0:
+            return {'step_count': 0, 'order_count': 0, 'episode_count': 0}
+        # up to the end of the last completed episode
+        episodes = np.memmap(f'{self.directory}/episodes.bin', dtype=EPISODE_DTYPE, mode='r',
+                             shape=(meta['episode_count'],))
+        step_count = int(episodes[-1]['start'] + episodes[-1]['length'])
+        del episodes
+        order_count = 0
+        if step_count > 0:
+            steps = np.memmap(f'{self.directory}/steps.bin', dtype=STEP_DTYPE, mode='r',
+                              shape=(step_count,))
+            order_count = int(steps[-1]['order_start'] + steps[-1]['order_count'])
+            del steps
+        return {'step_count': step_count, 'order_count': order_count,
+                'episode_count': meta['episode_count']}
+
+    def start_episode(self, episode):
+        self.episode = episode + self.episode_offset
+        self.episode_start = self.steps.count
+
+    def append(self, step, frame, orders):
+        step['episode'] = self.episode
+        step['order_start'] = self.orders.count
+        step['order_count'] = len(orders)
+        self.steps.append(step)
+        self.frames.append(frame)
+        if len(orders) > 0:
+            self.orders.extend(orders)
+
+    def end_episode(self):
+        if self.episode is None:
+            return
+        self.episodes.append((self.episode, self.episode_start,
+                              self.steps.count - self.episode_start))
+        self.episode = None
+        self.flush()
+
+    def flush(self):
+        for array in (self.steps, self.frames, self.orders, self.episodes):
+            array.flush()
+        self._write_meta()
+
+    def close(self):
+        for array in (self.steps, self.frames, self.orders, self.episodes):
+            array.close()
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            'version': DATASET_VERSION,
+            'frame_fields': list(FRAME_FIELDS),
+            'company_ids': self.company_ids.tolist(),
+            'step_count': self.steps.count,
+            'order_count': self.orders.count,
+            'episode_count': self.episodes.count,
+        }
+        with open(f'{self.directory}/{DATASET_META_FILE_NAME}', 'w') as f:
+            json.dump(meta, f)
+
+
+class TrajectoryShard:
+    def __init__(self, directory):
+        with open(f'{directory}/{DATASET_META_FILE_NAME}') as f:
+            meta = json.load(f)
+        if meta['version'] != DATASET_VERSION:
+            raise ValueError(f'Unsupported dataset version:{meta["version"]}')
+        self.directory = directory
+        self.company_ids = np.array(meta['company_ids'], dtype=np.int64)
+        step_count = meta['step_count']
+        frame_shape = (len(meta['frame_fields']), len(self.company_ids))
+        # only the rows recorded in the meta are mapped, a shard may still be written
+        self.steps = self._open(f'{directory}/steps.bin', STEP_DTYPE, (step_count,))
+        self.frames = self._open(f'{directory}/frames.bin', np.float32,
+                                 (step_count,) + frame_shape)
+        self.orders = self._open(f'{directory}/orders.bin', ORDER_DTYPE, (meta['order_count'],))
+        self.episodes = self._open(f'{directory}/episodes.bin', EPISODE_DTYPE,
+                                   (meta['episode_count'],))
+
+    @staticmethod
+    def _open(file_name, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(file_name, dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def get_orders(self, index):
+        step = self.steps[index]
+        start = int(step['order_start'])
+        return np.array(self.orders[start:start + int(step['order_count'])])
+
+
+class TrajectoryDataset:
+    """
+    Reads all shards under a directory without loading them into memory,
+    minibatches are gathered straight from the memory maps.
+    """
+
+    def __init__(self, directory):
+        shard_directories = sorted(os.path.dirname(meta_file) for meta_file in
+                                   glob.glob(f'{directory}/*/{DATASET_META_FILE_NAME}'))
+        self.shards = [TrajectoryShard(shard_directory) for shard_directory in shard_directories]
+        self.shards = [shard for shard in self.shards if len(shard) > 0]
+        if not self.shards:
+            raise ValueError(f'No recorded steps in {directory}')
+        self.company_ids = self.shards[0].company_ids
+        for shard in self.shards[1:]:
+            if not np.array_equal(shard.company_ids, self.company_ids):
+                raise ValueError(f'Shard {shard.directory} was recorded with another universe')
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def sample(self, batch_size, np_random=None, with_orders=False):
+        if np_random is None:
+            np_random = np.random
+        indexes = np.sort(np_random.randint(0, len(self), size=batch_size))
+        return self.get_batch(indexes, with_orders)
+
+    def get_batch(self, indexes, with_orders=False):
+        # transitions (frame, action, reward, next_frame, done), the next frame
+        # of the last step of an episode is its own frame
+        indexes = np.asarray(indexes, dtype=np.int64)
+        shard_indexes = np.searchsorted(self.offsets, indexes, side='right') - 1
+        steps = np.zeros(len(indexes), dtype=STEP_DTYPE)
+        frames = np.zeros((len(indexes),) + self.shards[0].frames.shape[1:], dtype=np.float32)
+        next_frames = np.zeros_like(frames)
+        orders = [None] * len(indexes) if with_orders else None
+        for shard_index in np.unique(shard_indexes):
+            shard = self.shards[shard_index]
+            selected = np.flatnonzero(shard_indexes == shard_index)
+            rows = indexes[selected] - self.offsets[shard_index]
+            steps[selected] = shard.steps[rows]
+            frames[selected] = shard.frames[rows]
+            next_rows = np.minimum(rows + 1, len(shard) - 1)
+            next_rows = np.where(shard.steps['done'][rows] |
+                                 (shard.steps['episode'][next_rows] != shard.steps['episode'][rows]),
+                                 rows, next_rows)
+            next_frames[selected] = shard.frames[next_rows]
+            if with_orders:
+                for position, row in zip(selected, rows):
+                    orders[position] = shard.get_orders(row)
+        batch = {name: steps[name] for name in ('day', 'second', 'total_value', 'available_fund',
+                                                'bank_balance', 'reward', 'done', 'end_batch')}
+        batch['frames'] = frames
+        batch['next_frames'] = next_frames
+        if with_orders:
+            batch['orders'] = orders
+        return batch
@@ -0,0 +1,116 @@
+import numpy as np
+
+from .constants import BUY_STOCK, SELL_STOCK
+
+
+class BrokerageFeeTable:
+    def __init__(self, transaction_fee):
+        # tiers are (amount, fee, is_percentage), the smallest tier with amount <= threshold
+        # applies, tiers are sorted here so the fee list can be given in any order
+        transaction_fee = sorted(transaction_fee, key=lambda t: t.amount)
+        self.thresholds = np.array([t.amount for t in transaction_fee], dtype=np.float64)
+        self.fees = np.array([t.fee for t in transaction_fee], dtype=np.float64)
+        self.is_percentage = np.array([t.is_percentage for t in transaction_fee], dtype=bool)
+
+    def calculate(self, amounts):
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if len(self.thresholds) == 0:
+            return np.zeros_like(amounts)
+        tiers = np.searchsorted(self.thresholds, amounts, side='left')
+        matched = tiers < len(self.thresholds)
+        tiers = np.minimum(tiers, len(self.thresholds) - 1)
+        fees = np.where(self.is_percentage[tiers], amounts * self.fees[tiers] / 100.0,
+                        self.fees[tiers])
+        return np.round(np.where(matched, fees, 0.0), 2)
+
+
+class OrderExecution:
+    def __init__(self, order_count):
+        self.buy_orders = np.zeros(order_count, dtype=bool)
+        self.sell_orders = np.zeros(order_count, dtype=bool)
+        self.buy_all_orders = np.zeros(order_count, dtype=bool)
+        self.buy_fulfilled = np.zeros(order_count, dtype=bool)
+        self.sell_fulfilled = np.zeros(order_count, dtype=bool)
+        self.execution_prices = np.zeros(order_count, dtype=np.float64)
+        self.amounts = np.zeros(order_count, dtype=np.float64)
+        self.fees = np.zeros(order_count, dtype=np.float64)
+        self.available_fund = 0.0
+
+
+def grouped_cumsum(keys, values):
+    # running sum of values per key, in the original order
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sorted_sums = np.cumsum(values[order])
+    group_starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    start_index = np.maximum.accumulate(np.where(group_starts, np.arange(len(keys)), 0))
+    sorted_sums -= (sorted_sums - values[order])[start_index]
+    sums = np.empty_like(sorted_sums)
+    sums[order] = sorted_sums
+    return sums
+
+
+def greedy_accept(keys, costs, budgets):
+    # Orders are accepted in submission order while their cost fits the budget of
+    # their key, an order that doesn't fit is skipped and the later ones still
+    # fill. Each round accepts, vectorized, the fitting prefix of every key. The
+    # budgets only shrink, so orders costing more than what is left are rejected
+    # at once and every round rejects at least one order. Returns (accepted,
+    # remaining budget of each order's key).
+    accepted = np.zeros(len(keys), dtype=bool)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    remaining = np.asarray(budgets, dtype=np.float64)[first]
+    pending = np.arange(len(keys))
+    while len(pending) > 0:
+        pending = pending[costs[pending] <= remaining[inverse[pending]]]
+        if len(pending) == 0:
+            break
+        groups = inverse[pending]
+        fits = grouped_cumsum(groups, costs[pending]) <= remaining[groups]
+        blocked = grouped_cumsum(groups, (~fits).astype(np.int64)) > 0
+        taken = pending[~blocked]
+        accepted[taken] = True
+        remaining -= np.bincount(inverse[taken], weights=costs[taken], minlength=len(remaining))
+        pending = pending[blocked]
+    return accepted, remaining[inverse]
+
+
+def match_orders(stock_operations, company_ids, prices, volumes,
+                 ask_prices, bid_prices, holdings, tradable,
+                 available_fund, fee_table: BrokerageFeeTable):
+    # Sells are matched against bid first (each company limited by its holding),
+    # then sized buys against ask limited by the fund, both greedily in submission
+    # order skipping the orders that don't fit, like the sequential matching.
+    # A batch that fits is a single vectorized pass, see greedy_accept otherwise.
+    # Buys with no volume ("buy with all available fund") are only flagged,
+    # they depend on the fund left and are executed one by one by the env.
+    execution = OrderExecution(len(company_ids))
+    execution.buy_orders = tradable & (stock_operations == BUY_STOCK) & (prices >= ask_prices)
+    execution.sell_orders = tradable & (stock_operations == SELL_STOCK) & (prices <= bid_prices)
+    execution.execution_prices = np.where(execution.buy_orders, ask_prices, bid_prices)
+    execution.buy_all_orders = execution.buy_orders & (volumes < 1e-5) & (ask_prices > 1e-5)
+    sized_buys = execution.buy_orders & ~execution.buy_all_orders
+
+    amounts = np.round(volumes * execution.execution_prices, 3)
+    fees = fee_table.calculate(amounts)
+
+    sell_index = np.flatnonzero(execution.sell_orders)
+    if len(sell_index) > 0:
+        execution.sell_fulfilled[sell_index], _ = greedy_accept(
+            company_ids[sell_index], volumes[sell_index], holdings[sell_index])
+    proceeds = np.where(execution.sell_fulfilled, amounts - fees, 0.0)
+    available_fund = available_fund + proceeds.sum()
+
+    buy_index = np.flatnonzero(sized_buys)
+    if len(buy_index) > 0:
+        costs = amounts[buy_index] + fees[buy_index]
+        execution.buy_fulfilled[buy_index], _ = greedy_accept(
+            np.zeros(len(buy_index), dtype=np.int64), costs, np.full(len(buy_index), available_fund))
+        available_fund -= costs[execution.buy_fulfilled[buy_index]].sum()
+
+    fulfilled = execution.buy_fulfilled | execution.sell_fulfilled
+    execution.amounts = np.where(fulfilled, amounts, 0.0)
+    execution.fees = np.where(fulfilled, fees, 0.0)
+    execution.available_fund = available_fund
+    return execution
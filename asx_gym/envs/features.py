@@ -0,0 +1,230 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class Indicator(ABC):
+    # Incremental indicator over a fixed universe of companies, every update
+    # is O(1) in the window length and vectorized across the universe.
+    name = ''
+
+    def __init__(self, size):
+        self.size = size
+
+    @property
+    def key(self):
+        return self.name
+
+    def reset(self):
+        pass
+
+    def start(self, columns, prices, high_prices, low_prices):
+        # seeds the state of companies seen for the first time
+        pass
+
+    @abstractmethod
+    def update(self, prices, high_prices, low_prices):
+        pass
+
+
+class ReturnIndicator(Indicator):
+    name = 'return'
+
+    def __init__(self, size, period=1):
+        super().__init__(size)
+        self.period = period
+        self.buffer = np.zeros((period, size))
+        self.reset()
+
+    @property
+    def key(self):
+        return f'{self.name}_{self.period}'
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.position = 0
+
+    def start(self, columns, prices, high_prices, low_prices):
+        self.buffer[:, columns] = prices[columns]
+
+    def update(self, prices, high_prices, low_prices):
+        previous = self.buffer[self.position]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(previous > 0, prices / previous - 1.0, np.nan)
+        self.buffer[self.position] = prices
+        self.position = (self.position + 1) % self.period
+        return values
+
+
+class SmaIndicator(Indicator):
+    name = 'sma'
+
+    def __init__(self, size, window=20):
+        super().__init__(size)
+        self.window = window
+        self.buffer = np.zeros((window, size))
+        self.total = np.zeros(size)
+        self.reset()
+
+    @property
+    def key(self):
+        return f'{self.name}_{self.window}'
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.total[:] = 0
+        self.position = 0
+
+    def start(self, columns, prices, high_prices, low_prices):
+        # the window is padded with the first price
+        self.buffer[:, columns] = prices[columns]
+        self.total[columns] = prices[columns] * self.window
+
+    def update(self, prices, high_prices, low_prices):
+        # running sum over a ring buffer
+        self.total += prices - self.buffer[self.position]
+        self.buffer[self.position] = prices
+        self.position = (self.position + 1) % self.window
+        return self.total / self.window
+
+
+class EmaIndicator(Indicator):
+    name = 'ema'
+
+    def __init__(self, size, span=20):
+        super().__init__(size)
+        self.span = span
+        self.alpha = 2.0 / (span + 1)
+        self.value = np.zeros(size)
+        self.reset()
+
+    @property
+    def key(self):
+        return f'{self.name}_{self.span}'
+
+    def reset(self):
+        self.value[:] = 0
+
+    def start(self, columns, prices, high_prices, low_prices):
+        self.value[columns] = prices[columns]
+
+    def update(self, prices, high_prices, low_prices):
+        self.value += self.alpha * (prices - self.value)
+        return self.value.copy()
+
+
+class RsiIndicator(Indicator):
+    name = 'rsi'
+
+    def __init__(self, size, period=14):
+        super().__init__(size)
+        self.period = period
+        self.previous = np.zeros(size)
+        self.average_gain = np.zeros(size)
+        self.average_loss = np.zeros(size)
+        self.reset()
+
+    @property
+    def key(self):
+        return f'{self.name}_{self.period}'
+
+    def reset(self):
+        self.previous[:] = 0
+        self.average_gain[:] = 0
+        self.average_loss[:] = 0
+
+    def start(self, columns, prices, high_prices, low_prices):
+        self.previous[columns] = prices[columns]
+        self.average_gain[columns] = 0
+        self.average_loss[columns] = 0
+
+    def update(self, prices, high_prices, low_prices):
+        changes = prices - self.previous
+        # Wilder smoothing
+        self.average_gain += (np.maximum(changes, 0) - self.average_gain) / self.period
+        self.average_loss += (np.maximum(-changes, 0) - self.average_loss) / self.period
+        self.previous[:] = prices
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = 100.0 - 100.0 / (1.0 + self.average_gain / self.average_loss)
+        values = np.where(self.average_loss > 0, values,
+                          np.where(self.average_gain > 0, 100.0, 50.0))
+        return values
+
+
+class AtrIndicator(Indicator):
+    # true range of whatever high/low the caller passes, see AsxFeatureWrapper
+    # for the tick level approximation
+    name = 'atr'
+
+    def __init__(self, size, period=14):
+        super().__init__(size)
+        self.period = period
+        self.previous = np.zeros(size)
+        self.value = np.zeros(size)
+        self.reset()
+
+    @property
+    def key(self):
+        return f'{self.name}_{self.period}'
+
+    def reset(self):
+        self.previous[:] = 0
+        self.value[:] = 0
+
+    def start(self, columns, prices, high_prices, low_prices):
+        self.previous[columns] = prices[columns]
+        self.value[columns] = high_prices[columns] - low_prices[columns]
+
+    def update(self, prices, high_prices, low_prices):
+        true_range = np.maximum(high_prices - low_prices,
+                                np.maximum(np.abs(high_prices - self.previous),
+                                           np.abs(low_prices - self.previous)))
+        # Wilder smoothing
+        self.value += (true_range - self.value) / self.period
+        self.previous[:] = prices
+        return self.value.copy()
+
+
+INDICATORS = {}
+
+
+def register_indicator(indicator_class):
+    INDICATORS[indicator_class.name] = indicator_class
+    return indicator_class
+
+
+for _indicator_class in (ReturnIndicator, SmaIndicator, EmaIndicator, RsiIndicator, AtrIndicator):
+    register_indicator(_indicator_class)
+
+
+def create_indicator(feature, size):
+    # feature is a registered name or a (name, params) tuple, e.g. ('sma', {'window': 20})
+    if isinstance(feature, str):
+        name, params = feature, {}
+    else:
+        name, params = feature
+    if name not in INDICATORS:
+        raise ValueError(f'Unknown indicator:{name}')
+    return INDICATORS[name](size, **params)
+
+
+class FeaturePipeline:
+    def __init__(self, features, size):
+        self.indicators = [create_indicator(feature, size) for feature in features]
+        self.size = size
+
+    @property
+    def keys(self):
+        return [indicator.key for indicator in self.indicators]
+
+    def reset(self):
+        for indicator in self.indicators:
+            indicator.reset()
+
+    def start(self, columns, prices, high_prices, low_prices):
+        for indicator in self.indicators:
+            indicator.start(columns, prices, high_prices, low_prices)
+
+    def update(self, prices, high_prices, low_prices):
+        return {indicator.key: indicator.update(prices, high_prices, low_prices)
+                for indicator in self.indicators}
@@ -1,5 +1,7 @@
 import random
 
+import numpy as np
+
 from .constants import TOP_UP_FUND, WITHDRAW_FUND, \
     BUY_STOCK, SELL_STOCK, \
     HOLD_STOCK
@@ -28,6 +30,7 @@ class StockDailySimulationPrices:
         self.low_price = low_price
         self.offset = 0
         self.current_index = 0
+        self.initialized = False
         self.simulation_prices = []
         first_price = StockSimulationPrice(open_price, open_price, open_price)
         self.simulation_prices.append(first_price)
@@ -45,6 +48,11 @@ class StockDailySimulationPrices:
 
         return ret_price
 
+    def init_daily_prices(self):
+        self.simulation_prices = [StockSimulationPrice(self.close_price, self.close_price,
+                                                       self.close_price)]
+        self.initialized = True
+
     def init_simulation_prices(self, arr):
         for data in arr:
             (normalized_ask_price, normalized_bid_price, normalized_stock_price) = data
@@ -60,6 +68,21 @@ class StockDailySimulationPrices:
         empty_count = max(24 - count - 1, 0)
         if empty_count > 0:
             self.offset = random.randint(1, empty_count)
+        self.initialized = True
+
+
+ORDER_DTYPE = np.dtype([('company_id', np.int32),
+                        ('stock_operation', np.int8),
+                        ('volume', np.float32),
+                        ('price', np.float32)])
+
+STOCK_OPERATION_NAMES = {
+    BUY_STOCK: 'buy',
+    SELL_STOCK: 'sell',
+    HOLD_STOCK: 'hold',
+    TOP_UP_FUND: 'top_up',
+    WITHDRAW_FUND: 'withdraw',
+}
 
 
 class AsxTransaction:
@@ -70,18 +93,7 @@ class AsxTransaction:
         self.price = price
 
     def to_json_obj(self):
-        if self.stock_operation == BUY_STOCK:
-            stock_operation = 'buy'
-        elif self.stock_operation == SELL_STOCK:
-            stock_operation = 'sell'
-        elif self.stock_operation == HOLD_STOCK:
-            stock_operation = 'hold'
-        elif self.stock_operation == TOP_UP_FUND:
-            stock_operation = 'top_up'
-        elif self.stock_operation == WITHDRAW_FUND:
-            stock_operation = 'withdraw'
-        else:
-            stock_operation = 'unknown'
+        stock_operation = STOCK_OPERATION_NAMES.get(self.stock_operation, 'unknown')
         json_obj = {
             'company_id': int(self.company_id),
             'stock_operation': stock_operation,
@@ -92,47 +104,85 @@ class AsxTransaction:
 
 
 class AsxAction:
-    def __init__(self, end_batch):
+    # a thin view over a structured array of orders (ORDER_DTYPE)
+    def __init__(self, end_batch, orders=None):
         self.end_batch = end_batch
-        self.transactions = []
+        if orders is None:
+            orders = np.zeros(8, dtype=ORDER_DTYPE)
+            self.count = 0
+        else:
+            self.count = len(orders)
+        self.buffer = orders
+
+    @property
+    def orders(self):
+        return self.buffer[:self.count]
+
+    @property
+    def transactions(self):
+        return [AsxTransaction(order['company_id'], order['stock_operation'],
+                               order['volume'], order['price'])
+                for order in self.orders]
+
+    def add_order(self, company_id, stock_operation, volume, price):
+        if self.count == len(self.buffer):
+            buffer = np.zeros(max(8, 2 * len(self.buffer)), dtype=ORDER_DTYPE)
+            buffer[:self.count] = self.buffer[:self.count]
+            self.buffer = buffer
+        self.buffer[self.count] = (company_id, stock_operation, volume, price)
+        self.count += 1
 
     def add_transaction(self, transaction: AsxTransaction):
-        self.transactions.append(transaction)
+        self.add_order(transaction.company_id, transaction.stock_operation,
+                       transaction.volume, transaction.price)
 
     def copy_to_env_action(self, action):
-        company_count = len(self.transactions)
+        company_count = self.count
+        orders = self.orders
         action['company_count'] = company_count
         action['end_batch'] = self.end_batch
-        for c in range(company_count):
-            asx_transaction: AsxTransaction = self.transactions[c]
-            action['company_id'][c] = asx_transaction.company_id
-            action['volume'][c] = asx_transaction.volume
-            action['price'][c] = asx_transaction.price
-            action['stock_operation'][c] = asx_transaction.stock_operation
+        action['company_id'][:company_count] = orders['company_id']
+        action['volume'][:company_count] = orders['volume']
+        action['price'][:company_count] = orders['price']
+        action['stock_operation'][:company_count] = orders['stock_operation']
         return action
 
     def to_json_obj(self):
+        orders = self.orders
+        stock_operations = [STOCK_OPERATION_NAMES.get(operation, 'unknown')
+                            for operation in orders['stock_operation'].tolist()]
         json_obj = {
             'end_batch': int(self.end_batch),
-            'transactions': []
+            'transactions': [
+                {
+                    'company_id': company_id,
+                    'stock_operation': stock_operation,
+                    'volume': volume,
+                    'price': price
+                }
+                for company_id, stock_operation, volume, price in
+                zip(orders['company_id'].tolist(), stock_operations,
+                    np.round(orders['volume'].astype(np.float64), 2).tolist(),
+                    np.round(orders['price'].astype(np.float64), 2).tolist())
+            ]
         }
-        for transaction in self.transactions:
-            json_obj['transactions'].append(transaction.to_json_obj())
         return json_obj
 
     @staticmethod
     def from_env_action(action):
+        if isinstance(action, AsxAction):
+            return action
+        if isinstance(action, np.ndarray):
+            if action.dtype != ORDER_DTYPE:
+                action = action.astype(ORDER_DTYPE)
+            return AsxAction(0, action)
         company_count = action['company_count']
-        end_batch = action['end_batch']
-        asx_action = AsxAction(end_batch)
-        for c in range(company_count):
-            company_id = action['company_id'][c]
-            volume = action['volume'][c]
-            price = action['price'][c]
-            stock_operation = action['stock_operation'][c]
-            asx_transaction = AsxTransaction(company_id, stock_operation, volume, price)
-            asx_action.add_transaction(asx_transaction)
-        return asx_action
+        orders = np.zeros(company_count, dtype=ORDER_DTYPE)
+        orders['company_id'] = action['company_id'][:company_count]
+        orders['stock_operation'] = action['stock_operation'][:company_count]
+        orders['volume'] = action['volume'][:company_count]
+        orders['price'] = action['price'][:company_count]
+        return AsxAction(action['end_batch'], orders)
 
 
 class StockIndex:
@@ -186,67 +236,172 @@ class StockRecord:
         self.price = price
 
 
+class AsxPriceView:
+    # dict-like {company_id: StockSimulationPrice} over the observation price buffers
+    def __init__(self, company_ids, ask_prices, bid_prices, prices):
+        self.company_ids = company_ids
+        self.ask_prices = ask_prices
+        self.bid_prices = bid_prices
+        self.prices = prices
+        self.rows = None
+
+    def _row(self, company_id):
+        if self.rows is None:
+            self.rows = {company_id: row for row, company_id in enumerate(self.company_ids.tolist())}
+        return self.rows[int(company_id)]
+
+    def _price(self, row):
+        return StockSimulationPrice(self.ask_prices[row].item(), self.bid_prices[row].item(),
+                                    self.prices[row].item())
+
+    def __len__(self):
+        return len(self.company_ids)
+
+    def __contains__(self, company_id):
+        try:
+            self._row(company_id)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, company_id):
+        return self._price(self._row(company_id))
+
+    def __iter__(self):
+        return iter(self.company_ids.tolist())
+
+    def keys(self):
+        return self.company_ids.tolist()
+
+    def items(self):
+        for row, company_id in enumerate(self.company_ids.tolist()):
+            yield company_id, self._price(row)
+
+
 class AsxObservation:
+    # A lazy view over the env observation buffers, fields are only converted
+    # when they are touched. The env reuses its buffers, so use (or copy) the
+    # view before the next step.
     def __init__(self, observation):
+        self.observation = observation
         self.day = observation['day']
         self.seconds = observation['second']
-        self.total_value = float(observation['total_value'].item())
-        self.available_fund = float(observation['available_fund'].item())
-        self.bank_balance = float(observation['bank_balance'].item())
-        open_index = float(observation['indexes']['open'].item())
-        close_index = float(observation['indexes']['close'].item())
-        high_index = float(observation['indexes']['high'].item())
-        low_index = float(observation['indexes']['low'].item())
-        self.stock_index = StockIndex('', open_index,
-                                      close_index, high_index, low_index)
-
-        self.portfolios = []
-        self.prices = {}
-        company_count = observation['company_count']
-        for c in range(company_count):
-            company_id = observation['prices']['company_id'][c].item()
-            ask_price = observation['prices']['ask_price'][c].item()
-            bid_price = observation['prices']['bid_price'][c].item()
-            price = observation['prices']['price'][c].item()
-            self.prices[company_id] = StockSimulationPrice(ask_price, bid_price, price)
-
-        portfolio_company_count = observation['portfolio_company_count']
-        for c in range(portfolio_company_count):
-            company_id = observation['portfolios']['company_id'][c].item()
-            volume = observation['portfolios']['volume'][c].item()
-            buy_price = observation['portfolios']['buy_price'][c].item()
-            sell_price = observation['portfolios']['sell_price'][c].item()
-            price = observation['portfolios']['price'][c].item()
-            stock_record = StockRecord(company_id, volume, buy_price, sell_price, price)
-            self.portfolios.append(stock_record)
+        self.company_count = observation['company_count']
+        self.portfolio_company_count = observation['portfolio_company_count']
+
+    @property
+    def total_value(self):
+        return float(self.observation['total_value'].item())
+
+    @property
+    def available_fund(self):
+        return float(self.observation['available_fund'].item())
+
+    @property
+    def bank_balance(self):
+        return float(self.observation['bank_balance'].item())
+
+    @property
+    def stock_index(self):
+        indexes = self.observation['indexes']
+        return StockIndex('', float(indexes['open'].item()), float(indexes['close'].item()),
+                          float(indexes['high'].item()), float(indexes['low'].item()))
+
+    def __getitem__(self, name):
+        if name in ('company_id', 'ask_price', 'bid_price', 'price'):
+            return self.observation['prices'][name][:self.company_count]
+        if name.startswith('portfolio_'):
+            return self.observation['portfolios'][name[len('portfolio_'):]][
+                   :self.portfolio_company_count]
+        return self.observation[name]
+
+    @property
+    def company_ids(self):
+        return self['company_id']
+
+    @property
+    def ask_prices(self):
+        return self['ask_price']
+
+    @property
+    def bid_prices(self):
+        return self['bid_price']
+
+    @property
+    def current_prices(self):
+        return self['price']
+
+    @property
+    def portfolio_company_ids(self):
+        return self['portfolio_company_id']
+
+    @property
+    def portfolio_volumes(self):
+        return self['portfolio_volume']
+
+    @property
+    def portfolio_buy_prices(self):
+        return self['portfolio_buy_price']
+
+    @property
+    def portfolio_sell_prices(self):
+        return self['portfolio_sell_price']
+
+    @property
+    def portfolio_prices(self):
+        return self['portfolio_price']
+
+    @property
+    def prices(self):
+        return AsxPriceView(self.company_ids, self.ask_prices, self.bid_prices,
+                            self.current_prices)
+
+    @property
+    def portfolios(self):
+        return [StockRecord(company_id, volume, buy_price, sell_price, price)
+                for company_id, volume, buy_price, sell_price, price in
+                zip(self.portfolio_company_ids.tolist(), self.portfolio_volumes.tolist(),
+                    self.portfolio_buy_prices.tolist(), self.portfolio_sell_prices.tolist(),
+                    self.portfolio_prices.tolist())]
 
     def to_json_obj(self):
+        indexes = self.observation['indexes']
         json_obj = {"day": int(self.day),
                     "seconds": int(self.seconds),
                     "total_value": round(self.total_value, 2),
                     "available_fund": round(self.available_fund, 2),
                     "bank_balance": round(self.bank_balance, 2),
                     "index": {
-                        "open": round(self.stock_index.open_index, 2),
-                        "close": round(self.stock_index.close_index, 2),
-                        "high": round(self.stock_index.high_index, 2),
-                        "low": round(self.stock_index.low_index, 2)
+                        "open": round(float(indexes['open'].item()), 2),
+                        "close": round(float(indexes['close'].item()), 2),
+                        "high": round(float(indexes['high'].item()), 2),
+                        "low": round(float(indexes['low'].item()), 2)
                     },
                     "prices": {},
                     "portfolios": {}}
-        for company_id, prices in self.prices.items():
+        company_ids = self.company_ids.tolist()
+        ask_prices = np.round(self.ask_prices, 2).tolist()
+        bid_prices = np.round(self.bid_prices, 2).tolist()
+        prices = np.round(self.current_prices, 2).tolist()
+        for company_id, ask_price, bid_price, price in \
+                zip(company_ids, ask_prices, bid_prices, prices):
             json_obj["prices"][company_id] = {
-                "ask_price": round(prices.ask_price, 2),
-                "bid_price": round(prices.bid_price, 2),
-                "price": round(prices.price, 2)
-
+                "ask_price": ask_price,
+                "bid_price": bid_price,
+                "price": price
             }
-        for stock_record in self.portfolios:
-            json_obj["portfolios"][stock_record.company_id] = {
-                "volume": round(stock_record.volume, 2),
-                "buy_price": round(stock_record.buy_price, 2),
-                "sell_price": round(stock_record.sell_price, 2),
-                "price": round(stock_record.price, 2)
+        portfolio_company_ids = self.portfolio_company_ids.tolist()
+        volumes = np.round(self.portfolio_volumes, 2).tolist()
+        buy_prices = np.round(self.portfolio_buy_prices, 2).tolist()
+        sell_prices = np.round(self.portfolio_sell_prices, 2).tolist()
+        portfolio_prices = np.round(self.portfolio_prices, 2).tolist()
+        for company_id, volume, buy_price, sell_price, price in \
+                zip(portfolio_company_ids, volumes, buy_prices, sell_prices, portfolio_prices):
+            json_obj["portfolios"][company_id] = {
+                "volume": volume,
+                "buy_price": buy_price,
+                "sell_price": sell_price,
+                "price": price
             }
 
         return json_obj
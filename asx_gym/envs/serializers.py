@@ -0,0 +1,285 @@
+import json
+import struct
+
+import numpy as np
+
+from .models import AsxAction, AsxObservation
+
+FORMAT_JSON = 'json'
+FORMAT_NDJSON = 'ndjson'
+FORMAT_BINARY = 'binary'
+
+BINARY_MAGIC = b'AX'
+BINARY_VERSION = 1
+FLAG_DELTA = 1
+FLAG_ACTION = 2
+# extra fields (e.g. date_time, transactions) as a length prefixed json trailer
+FLAG_EXTRA = 4
+
+# little endian wire layout, independent of the platform
+RECORD_LENGTH = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<2sBBIiiddddddddIIIB')
+PRICE_RECORD_DTYPE = np.dtype([('company_id', '<u2'), ('ask_price', '<f4'),
+                               ('bid_price', '<f4'), ('price', '<f4')])
+PORTFOLIO_RECORD_DTYPE = np.dtype([('company_id', '<u2'), ('volume', '<f8'),
+                                   ('buy_price', '<f4'), ('sell_price', '<f4'),
+                                   ('price', '<f4')])
+ORDER_RECORD_DTYPE = np.dtype([('company_id', '<i4'), ('stock_operation', 'i1'),
+                               ('volume', '<f4'), ('price', '<f4')])
+MAX_COMPANY_ID = np.iinfo(np.uint16).max
+
+
+def dumps_compact(json_obj):
+    return json.dumps(json_obj, separators=(',', ':'))
+
+
+class PriceDeltaTracker:
+    # remembers the last sent prices per company id to only send changed ones
+    def __init__(self):
+        self.company_ids = None
+        self.prices = np.zeros((MAX_COMPANY_ID + 1, 3), dtype=np.float32)
+
+    def reset(self):
+        self.company_ids = None
+
+    def changed_rows(self, company_ids, prices):
+        # returns (is_delta, mask of rows to send)
+        prices = prices.astype(np.float32)
+        is_delta = self.company_ids is not None and np.array_equal(self.company_ids, company_ids)
+        if is_delta:
+            changed = np.any(self.prices[company_ids] != prices, axis=1)
+        else:
+            changed = np.ones(len(company_ids), dtype=bool)
+            self.company_ids = company_ids.copy()
+        self.prices[company_ids] = prices
+        return is_delta, changed
+
+
+class StepSerializer:
+    def __init__(self, format=FORMAT_NDJSON, delta=True):
+        if format not in (FORMAT_NDJSON, FORMAT_BINARY):
+            raise ValueError(f'Unknown serializer format:{format}')
+        self.format = format
+        self.delta = delta
+        self.step = 0
+        self.tracker = PriceDeltaTracker()
+
+    def reset(self):
+        self.step = 0
+        self.tracker.reset()
+
+    def encode(self, observation, asx_action=None, reward=0.0, extra=None):
+        if not isinstance(observation, AsxObservation):
+            observation = AsxObservation(observation)
+        if asx_action is not None:
+            asx_action = AsxAction.from_env_action(asx_action)
+        company_ids = observation.company_ids.astype(np.int64)
+        prices = np.stack([observation.ask_prices, observation.bid_prices,
+                           observation.current_prices], axis=1)
+        if self.delta:
+            is_delta, changed = self.tracker.changed_rows(company_ids, prices)
+        else:
+            is_delta, changed = False, np.ones(len(company_ids), dtype=bool)
+        self.step += 1
+        if self.format == FORMAT_BINARY:
+            return self._encode_binary(observation, asx_action, reward,
+                                       company_ids[changed], prices[changed], is_delta, extra)
+        return self._encode_ndjson(observation, asx_action, reward,
+                                   company_ids[changed], prices[changed], is_delta, extra)
+
+    def _encode_ndjson(self, observation, asx_action, reward, company_ids, prices,
+                       is_delta, extra):
+        stock_index = observation.stock_index
+        rounded = np.round(prices.astype(np.float64), 3).tolist()
+        json_obj = {
+            'step': self.step,
+            'day': int(observation.day),
+            'seconds': int(observation.seconds),
+            'reward': round(float(reward), 2),
+            'total_value': round(observation.total_value, 2),
+            'available_fund': round(observation.available_fund, 2),
+            'bank_balance': round(observation.bank_balance, 2),
+            'index': [round(stock_index.open_index, 2), round(stock_index.close_index, 2),
+                      round(stock_index.high_index, 2), round(stock_index.low_index, 2)],
+            'delta': is_delta,
+            # company_id: [ask, bid, price]
+            'prices': dict(zip(company_ids.tolist(), rounded)),
+            # company_id: [volume, buy_price, sell_price, price]
+            'portfolios': dict(zip(observation.portfolio_company_ids.tolist(),
+                                   np.round(np.stack([observation.portfolio_volumes,
+                                                      observation.portfolio_buy_prices,
+                                                      observation.portfolio_sell_prices,
+                                                      observation.portfolio_prices], axis=1),
+                                            3).tolist())),
+        }
+        if asx_action is not None:
+            orders = asx_action.orders
+            json_obj['action'] = {
+                'end_batch': int(asx_action.end_batch),
+                # [company_id, stock_operation, volume, price]
+                'orders': [list(order) for order in zip(
+                    orders['company_id'].tolist(), orders['stock_operation'].tolist(),
+                    np.round(orders['volume'].astype(np.float64), 2).tolist(),
+                    np.round(orders['price'].astype(np.float64), 3).tolist())]
+            }
+        if extra:
+            json_obj.update(extra)
+        return (dumps_compact(json_obj) + '\n').encode('utf-8')
+
+    def _encode_binary(self, observation, asx_action, reward, company_ids, prices, is_delta,
+                       extra):
+        stock_index = observation.stock_index
+        flags = 0
+        if is_delta:
+            flags |= FLAG_DELTA
+        order_count = 0
+        end_batch = 0
+        if asx_action is not None:
+            flags |= FLAG_ACTION
+            order_count = asx_action.count
+            end_batch = int(asx_action.end_batch)
+        if extra:
+            flags |= FLAG_EXTRA
+
+        price_records = np.zeros(len(company_ids), dtype=PRICE_RECORD_DTYPE)
+        price_records['company_id'] = company_ids
+        price_records['ask_price'] = prices[:, 0]
+        price_records['bid_price'] = prices[:, 1]
+        price_records['price'] = prices[:, 2]
+
+        portfolio_records = np.zeros(observation.portfolio_company_count,
+                                     dtype=PORTFOLIO_RECORD_DTYPE)
+        portfolio_records['company_id'] = observation.portfolio_company_ids
+        portfolio_records['volume'] = observation.portfolio_volumes
+        portfolio_records['buy_price'] = observation.portfolio_buy_prices
+        portfolio_records['sell_price'] = observation.portfolio_sell_prices
+        portfolio_records['price'] = observation.portfolio_prices
+
+        header = RECORD_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags, self.step,
+                                    int(observation.day), int(observation.seconds),
+                                    float(reward), observation.total_value,
+                                    observation.available_fund, observation.bank_balance,
+                                    stock_index.open_index, stock_index.close_index,
+                                    stock_index.high_index, stock_index.low_index,
+                                    len(price_records), len(portfolio_records),
+                                    order_count, end_batch)
+        body = [header, price_records.tobytes(), portfolio_records.tobytes()]
+        if asx_action is not None:
+            body.append(asx_action.orders.astype(ORDER_RECORD_DTYPE).tobytes())
+        if extra:
+            extra_json = dumps_compact(extra).encode('utf-8')
+            body.append(RECORD_LENGTH.pack(len(extra_json)))
+            body.append(extra_json)
+        payload = b''.join(body)
+        return RECORD_LENGTH.pack(len(payload)) + payload
+
+
+class StepDeserializer:
+    # rebuilds full price snapshots from (possibly delta encoded) records
+    def __init__(self, format=FORMAT_NDJSON):
+        self.format = format
+        self.prices = {}
+
+    def decode(self, record):
+        if self.format == FORMAT_BINARY:
+            return self._decode_binary(record)
+        return self._decode_ndjson(record)
+
+    def _decode_ndjson(self, record):
+        if isinstance(record, bytes):
+            record = record.decode('utf-8')
+        json_obj = json.loads(record)
+        prices = {int(company_id): value for company_id, value in json_obj['prices'].items()}
+        if json_obj['delta']:
+            self.prices.update(prices)
+        else:
+            self.prices = prices
+        json_obj['prices'] = dict(self.prices)
+        json_obj['portfolios'] = {int(company_id): value
+                                  for company_id, value in json_obj['portfolios'].items()}
+        return json_obj
+
+    def _decode_binary(self, record):
+        # accepts records with or without the length prefix
+        if len(record) >= RECORD_LENGTH.size and \
+                RECORD_LENGTH.unpack_from(record)[0] == len(record) - RECORD_LENGTH.size:
+            record = record[RECORD_LENGTH.size:]
+        (magic, version, flags, step, day, seconds, reward, total_value, available_fund,
+         bank_balance, open_index, close_index, high_index, low_index,
+         price_count, portfolio_count, order_count, end_batch) = RECORD_HEADER.unpack_from(record)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError('Not an asx gym binary step record')
+        offset = RECORD_HEADER.size
+        price_records = np.frombuffer(record, dtype=PRICE_RECORD_DTYPE,
+                                      count=price_count, offset=offset)
+        offset += price_records.nbytes
+        portfolio_records = np.frombuffer(record, dtype=PORTFOLIO_RECORD_DTYPE,
+                                          count=portfolio_count, offset=offset)
+        offset += portfolio_records.nbytes
+
+        prices = {company_id: [ask_price, bid_price, price]
+                  for company_id, ask_price, bid_price, price in
+                  zip(price_records['company_id'].tolist(),
+                      price_records['ask_price'].tolist(),
+                      price_records['bid_price'].tolist(),
+                      price_records['price'].tolist())}
+        if flags & FLAG_DELTA:
+            self.prices.update(prices)
+        else:
+            self.prices = prices
+        json_obj = {
+            'step': step,
+            'day': day,
+            'seconds': seconds,
+            'reward': reward,
+            'total_value': total_value,
+            'available_fund': available_fund,
+            'bank_balance': bank_balance,
+            'index': [open_index, close_index, high_index, low_index],
+            'delta': bool(flags & FLAG_DELTA),
+            'prices': dict(self.prices),
+            'portfolios': {company_id: [volume, buy_price, sell_price, price]
+                           for company_id, volume, buy_price, sell_price, price in
+                           zip(portfolio_records['company_id'].tolist(),
+                               portfolio_records['volume'].tolist(),
+                               portfolio_records['buy_price'].tolist(),
+                               portfolio_records['sell_price'].tolist(),
+                               portfolio_records['price'].tolist())},
+        }
+        if flags & FLAG_ACTION:
+            orders = np.frombuffer(record, dtype=ORDER_RECORD_DTYPE,
+                                   count=order_count, offset=offset)
+            json_obj['action'] = {
+                'end_batch': end_batch,
+                'orders': [list(order) for order in zip(
+                    orders['company_id'].tolist(), orders['stock_operation'].tolist(),
+                    orders['volume'].tolist(), orders['price'].tolist())]
+            }
+            offset += orders.nbytes
+        if flags & FLAG_EXTRA:
+            extra_length = RECORD_LENGTH.unpack_from(record, offset)[0]
+            offset += RECORD_LENGTH.size
+            json_obj.update(json.loads(record[offset:offset + extra_length].decode('utf-8')))
+        return json_obj
+
+
+def iter_binary_records(stream):
+    while True:
+        length = stream.read(RECORD_LENGTH.size)
+        if len(length) < RECORD_LENGTH.size:
+            return
+        yield stream.read(RECORD_LENGTH.unpack(length)[0])
+
+
+class HistoryWriter:
+    def __init__(self, file_name, format=FORMAT_NDJSON, delta=True):
+        self.serializer = StepSerializer(format, delta)
+        self.file = open(file_name, 'wb')
+
+    def write(self, observation, asx_action=None, reward=0.0, extra=None):
+        self.file.write(self.serializer.encode(observation, asx_action, reward, extra))
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
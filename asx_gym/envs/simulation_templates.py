@@ -0,0 +1,296 @@
+import json
+import os
+import random
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .constants import TEMPLATE_RATIO_BUCKETS, TEMPLATE_PRICE_SCALE, \
+    MAX_TEMPLATE_TICKS, TEMPLATE_LIBRARY_VERSION, DEFAULT_TEMPLATE_CACHE_BYTES
+from .utils import create_directory_if_not_exist
+
+PRICES_FILE = 'prices.npy'
+TEMPLATE_OFFSETS_FILE = 'template_offsets.npy'
+TEMPLATE_COMPANIES_FILE = 'template_companies.npy'
+BUCKET_OFFSETS_FILE = 'bucket_offsets.npy'
+META_FILE = 'meta.json'
+# templates read to estimate the bid/ask spread of a company, and ticks for the library default
+MAX_SPREAD_TEMPLATES = 64
+SPREAD_SAMPLE_TICKS = 100000
+
+
+def ratio_to_bucket(ratio):
+    return int(round(ratio * (TEMPLATE_RATIO_BUCKETS - 1)))
+
+
+def quantize_prices(prices):
+    quantized = np.rint(np.asarray(prices, dtype=np.float64) * TEMPLATE_PRICE_SCALE)
+    return np.clip(quantized, 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def dequantize_prices(quantized):
+    return quantized.astype(np.float64) / TEMPLATE_PRICE_SCALE
+
+
+def relative_spreads(prices):
+    # median (ask / price - 1, 1 - bid / price) of normalized ask, bid, price ticks
+    prices = prices[prices[:, 2] > 0]
+    if len(prices) == 0:
+        return 0.0, 0.0
+    ask_spread = np.median(prices[:, 0] / prices[:, 2] - 1.0)
+    bid_spread = np.median(1.0 - prices[:, 1] / prices[:, 2])
+    return max(float(ask_spread), 0.0), max(float(bid_spread), 0.0)
+
+
+def build_template_library(csv_file, output_directory, cache_bytes=DEFAULT_TEMPLATE_CACHE_BYTES):
+    # daily_stock_price.csv: cid,day,seconds,ask,bid,price,low,high (normalized by day high)
+    df = pd.read_csv(csv_file)
+    df.columns = ['cid', 'day', 'seconds', 'normalized_ask_price',
+                  'normalized_bid_price', 'normalized_stock_price',
+                  'normalized_low_price', 'normalized_high_price']
+    df['bucket'] = np.rint(df['normalized_low_price'].to_numpy()
+                           * (TEMPLATE_RATIO_BUCKETS - 1)).astype(np.int64)
+    df = df[(df.bucket >= 0) & (df.bucket < TEMPLATE_RATIO_BUCKETS)]
+    df = df.sort_values(['bucket', 'cid', 'day', 'seconds'], kind='mergesort')
+
+    # one template per (cid, day), truncated to the ticks the env replays
+    df['tick'] = df.groupby(['cid', 'day']).cumcount()
+    df = df[df.tick < MAX_TEMPLATE_TICKS]
+
+    starts = (df.tick == 0).to_numpy()
+    template_rows = np.flatnonzero(starts)
+    template_offsets = np.append(template_rows, len(df)).astype(np.int64)
+    template_buckets = df.bucket.to_numpy()[template_rows]
+    template_companies = df.cid.to_numpy()[template_rows].astype(np.int32)
+    bucket_offsets = np.searchsorted(template_buckets,
+                                     np.arange(TEMPLATE_RATIO_BUCKETS + 1)).astype(np.int64)
+
+    prices = quantize_prices(df[['normalized_ask_price', 'normalized_bid_price',
+                                 'normalized_stock_price']].to_numpy())
+
+    create_directory_if_not_exist(output_directory)
+    np.save(os.path.join(output_directory, PRICES_FILE), prices)
+    np.save(os.path.join(output_directory, TEMPLATE_OFFSETS_FILE), template_offsets)
+    np.save(os.path.join(output_directory, TEMPLATE_COMPANIES_FILE), template_companies)
+    np.save(os.path.join(output_directory, BUCKET_OFFSETS_FILE), bucket_offsets)
+    with open(os.path.join(output_directory, META_FILE), 'w') as meta_file:
+        json.dump({
+            'version': TEMPLATE_LIBRARY_VERSION,
+            'buckets': TEMPLATE_RATIO_BUCKETS,
+            'price_scale': TEMPLATE_PRICE_SCALE,
+            'max_ticks': MAX_TEMPLATE_TICKS,
+            'templates': int(len(template_rows)),
+            'ticks': int(len(prices)),
+        }, meta_file, indent=2)
+    return SimulationTemplateLibrary.load(output_directory, cache_bytes=cache_bytes)
+
+
+class TemplateBucket:
+    def __init__(self, prices, offsets):
+        self.prices = prices  # decoded ticks of all templates in the bucket
+        self.offsets = offsets  # template offsets relative to prices
+        self.nbytes = prices.nbytes + offsets.nbytes
+
+    @property
+    def template_count(self):
+        return len(self.offsets) - 1
+
+    def template_prices(self, index):
+        return self.prices[self.offsets[index]:self.offsets[index + 1]]
+
+
+class TemplateBucketCache:
+    def __init__(self, max_bytes=DEFAULT_TEMPLATE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def get(self, key):
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def put(self, key, bucket: TemplateBucket):
+        if bucket.nbytes > self.max_bytes:
+            return
+        previous = self.buckets.pop(key, None)
+        if previous is not None:
+            self.nbytes -= previous.nbytes
+        self.buckets[key] = bucket
+        self.nbytes += bucket.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.buckets.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self.buckets.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            'buckets': len(self.buckets),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class SimulationTemplateLibrary:
+    def __init__(self, prices, template_offsets, template_companies, bucket_offsets,
+                 cache_bytes=DEFAULT_TEMPLATE_CACHE_BYTES):
+        self.prices = prices
+        self.template_offsets = template_offsets
+        self.template_companies = template_companies
+        self.bucket_offsets = bucket_offsets
+        # sorted index of buckets that hold at least one template
+        self.available_buckets = np.flatnonzero(np.diff(bucket_offsets))
+        self.cache = TemplateBucketCache(cache_bytes)
+        # company id -> (ask spread, bid spread) relative to price
+        self.spreads = {}
+        self.default_spread = None
+
+    @staticmethod
+    def load(directory, mmap_mode='r', cache_bytes=DEFAULT_TEMPLATE_CACHE_BYTES):
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('version') != TEMPLATE_LIBRARY_VERSION or \
+                meta.get('buckets') != TEMPLATE_RATIO_BUCKETS or \
+                meta.get('price_scale') != TEMPLATE_PRICE_SCALE:
+            raise ValueError(f'Incompatible simulation template library in {directory}')
+        return SimulationTemplateLibrary(
+            np.load(os.path.join(directory, PRICES_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, TEMPLATE_OFFSETS_FILE)),
+            np.load(os.path.join(directory, TEMPLATE_COMPANIES_FILE)),
+            np.load(os.path.join(directory, BUCKET_OFFSETS_FILE)),
+            cache_bytes=cache_bytes)
+
+    @staticmethod
+    def load_or_build(directory, csv_file, cache_bytes=DEFAULT_TEMPLATE_CACHE_BYTES):
+        if os.path.exists(os.path.join(directory, META_FILE)):
+            try:
+                return SimulationTemplateLibrary.load(directory, cache_bytes=cache_bytes)
+            except ValueError:
+                pass
+        return build_template_library(csv_file, directory, cache_bytes=cache_bytes)
+
+    @property
+    def template_count(self):
+        return len(self.template_companies)
+
+    @property
+    def max_company_id(self):
+        if self.template_count == 0:
+            return 0
+        return int(self.template_companies.max())
+
+    def bucket_range(self, bucket):
+        if bucket < 0 or bucket >= TEMPLATE_RATIO_BUCKETS:
+            return 0, 0
+        return int(self.bucket_offsets[bucket]), int(self.bucket_offsets[bucket + 1])
+
+    def template_prices(self, template):
+        start = self.template_offsets[template]
+        end = self.template_offsets[template + 1]
+        return dequantize_prices(self.prices[start:end])
+
+    def bucket(self, bucket):
+        cached = self.cache.get(bucket)
+        if cached is not None:
+            return cached
+        start, end = self.bucket_range(bucket)
+        if start == end:
+            return None
+        tick_start = self.template_offsets[start]
+        tick_end = self.template_offsets[end]
+        decoded = TemplateBucket(dequantize_prices(self.prices[tick_start:tick_end]),
+                                 self.template_offsets[start:end + 1] - tick_start)
+        self.cache.put(bucket, decoded)
+        return decoded
+
+    def company_spread(self, company_id):
+        # spread of the company's own templates, the library median without any
+        spread = self.spreads.get(company_id)
+        if spread is None:
+            templates = np.flatnonzero(self.template_companies == company_id)
+            if len(templates) > 0:
+                spread = relative_spreads(np.concatenate(
+                    [self.template_prices(template)
+                     for template in templates[:MAX_SPREAD_TEMPLATES]]))
+            else:
+                if self.default_spread is None:
+                    step = max(len(self.prices) // SPREAD_SAMPLE_TICKS, 1)
+                    self.default_spread = relative_spreads(dequantize_prices(self.prices[::step]))
+                spread = self.default_spread
+            self.spreads[company_id] = spread
+        return spread
+
+    def nearest_bucket(self, ratio, tolerance=0.0):
+        if len(self.available_buckets) == 0:
+            return None
+        target = ratio_to_bucket(ratio)
+        position = np.searchsorted(self.available_buckets, target)
+        candidates = self.available_buckets[max(position - 1, 0):position + 1]
+        nearest = int(candidates[np.argmin(np.abs(candidates - target))])
+        if abs(nearest - target) > tolerance * (TEMPLATE_RATIO_BUCKETS - 1) + 1e-9:
+            return None
+        return nearest
+
+    def sample(self, ratio, tolerance=0.0):
+        # no template for a nan/inf ratio (high of 0 or missing), the caller falls back
+        if not np.isfinite(ratio):
+            return None
+        nearest = self.nearest_bucket(ratio, tolerance)
+        if nearest is None:
+            return None
+        bucket = self.bucket(nearest)
+        return bucket.template_prices(random.randrange(bucket.template_count))
+
+
+def bridgeable(high_prices, low_prices):
+    # rows generate_bridge_prices can normalize by high
+    high_prices = np.asarray(high_prices, dtype=np.float64)
+    low_prices = np.asarray(low_prices, dtype=np.float64)
+    return np.isfinite(high_prices) & (high_prices > 0) & np.isfinite(low_prices)
+
+
+def generate_bridge_prices(open_prices, close_prices, high_prices, low_prices,
+                           np_random, ticks=MAX_TEMPLATE_TICKS, ask_spreads=0.0, bid_spreads=0.0):
+    # Brownian bridge from open to close for every company at once, kept inside
+    # the day's [low, high] and touching both, normalized by high like the templates.
+    # Ask and bid are quoted around the price with the given relative spreads.
+    # High prices must be positive, see bridgeable.
+    high_prices = np.asarray(high_prices, dtype=np.float64)
+    normalized_open = np.asarray(open_prices, dtype=np.float64) / high_prices
+    normalized_close = np.asarray(close_prices, dtype=np.float64) / high_prices
+    normalized_low = np.asarray(low_prices, dtype=np.float64) / high_prices
+    count = len(high_prices)
+
+    times = np.arange(1, ticks + 1) / (ticks + 1)
+    walks = np.cumsum(np_random.normal(size=(count, ticks + 1)), axis=1) / np.sqrt(ticks + 1)
+    bridges = walks[:, :ticks] - times * walks[:, ticks:]
+    spreads = (1.0 - normalized_low)[:, None]
+    prices = normalized_open[:, None] + (normalized_close - normalized_open)[:, None] * times \
+        + spreads * bridges
+    prices = np.clip(prices, normalized_low[:, None], 1.0)
+
+    rows = np.arange(count)
+    prices[rows, np.argmax(prices, axis=1)] = 1.0
+    prices[rows, np.argmin(prices, axis=1)] = normalized_low
+    ask_spreads = np.broadcast_to(np.asarray(ask_spreads, dtype=np.float64), (count,))
+    bid_spreads = np.broadcast_to(np.asarray(bid_spreads, dtype=np.float64), (count,))
+    return np.stack([prices * (1.0 + ask_spreads[:, None]), prices * (1.0 - bid_spreads[:, None]),
+                     prices], axis=2)  # ask, bid, price
@@ -0,0 +1,185 @@
+import math
+
+from .constants import MAX_PRICE_VALUE
+
+
+class EpisodeStatistics:
+    def __init__(self):
+        self.episode: int = 0
+        self.steps: int = 0
+        self.available_fund: float = 0.0
+        self.start_date: str = ''
+        self.end_date: str = ''
+
+        self.index_open: float = 0.0
+        self.index_open_date: str = ''
+        self.index_close: float = 0.0
+        self.index_close_date: str = ''
+        self.index_high: float = 0.0
+        self.index_high_date: str = ''
+        self.index_low: float = MAX_PRICE_VALUE
+        self.index_low_date: str = ''
+
+        self.value_open: float = 0.0
+        self.value_open_date: str = ''
+        self.value_close: float = 0.0
+        self.value_close_date: str = ''
+        self.value_high: float = 0.0
+        self.value_high_date: str = ''
+        self.value_low: float = MAX_PRICE_VALUE
+        self.value_low_date: str = ''
+
+        # Welford running mean/variance of step returns
+        self.return_count: int = 0
+        self.return_mean: float = 0.0
+        self.return_m2: float = 0.0
+
+        self.peak_value: float = 0.0
+        self.max_drawdown: float = 0.0
+        self.max_drawdown_date: str = ''
+
+        self.turnover: float = 0.0
+        self.brokerage_fee: float = 0.0
+        self.buy_total: int = 0
+        self.buy_fulfilled: int = 0
+        self.sell_total: int = 0
+        self.sell_fulfilled: int = 0
+        self.winning_sells: int = 0
+
+    def reset(self, episode, date, value, index_open, index_close, index_high, index_low):
+        self.__init__()
+        self.episode = episode
+        self.available_fund = value
+        self.start_date = date
+        self.end_date = date
+
+        self.index_open, self.index_open_date = index_open, date
+        self.index_close, self.index_close_date = index_close, date
+        self.index_high, self.index_high_date = index_high, date
+        self.index_low, self.index_low_date = index_low, date
+
+        self.value_open, self.value_open_date = value, date
+        self.value_close, self.value_close_date = value, date
+        self.value_high, self.value_high_date = value, date
+        self.value_low, self.value_low_date = value, date
+        self.peak_value = value
+
+    def update_index(self, date, index_close, index_high, index_low):
+        self.end_date = date
+        self.index_close, self.index_close_date = index_close, date
+        if self.index_high < index_high:
+            self.index_high, self.index_high_date = index_high, date
+        if self.index_low > index_low:
+            self.index_low, self.index_low_date = index_low, date
+
+    def update_value(self, date, value):
+        previous_value = self.value_close
+        if previous_value > 0:
+            step_return = value / previous_value - 1.0
+            self.return_count += 1
+            delta = step_return - self.return_mean
+            self.return_mean += delta / self.return_count
+            self.return_m2 += delta * (step_return - self.return_mean)
+
+        if self.value_high < value:
+            self.value_high, self.value_high_date = value, date
+        if self.value_low > value:
+            self.value_low, self.value_low_date = value, date
+        self.value_close, self.value_close_date = value, date
+
+        if value > self.peak_value:
+            self.peak_value = value
+        elif self.peak_value > 0:
+            drawdown = (self.peak_value - value) / self.peak_value
+            if drawdown > self.max_drawdown:
+                self.max_drawdown, self.max_drawdown_date = drawdown, date
+
+    def record_buy(self, fulfilled, amount=0.0, brokerage_fee=0.0):
+        self.buy_total += 1
+        if fulfilled:
+            self.buy_fulfilled += 1
+            self.turnover += amount
+            self.brokerage_fee += brokerage_fee
+
+    def record_sell(self, fulfilled, amount=0.0, brokerage_fee=0.0, profitable=False):
+        self.sell_total += 1
+        if fulfilled:
+            self.sell_fulfilled += 1
+            self.turnover += amount
+            self.brokerage_fee += brokerage_fee
+            if profitable:
+                self.winning_sells += 1
+
+    @property
+    def total_return(self):
+        if self.value_open <= 0:
+            return 0.0
+        return self.value_close / self.value_open - 1.0
+
+    @property
+    def return_std(self):
+        if self.return_count < 2:
+            return 0.0
+        return math.sqrt(self.return_m2 / (self.return_count - 1))
+
+    @property
+    def sharpe_ratio(self):
+        # per step, not annualized
+        return_std = self.return_std
+        if return_std <= 0:
+            return 0.0
+        return self.return_mean / return_std
+
+    @property
+    def win_rate(self):
+        if self.sell_fulfilled == 0:
+            return 0.0
+        return self.winning_sells / self.sell_fulfilled
+
+    def to_json_obj(self):
+        return {
+            'steps': self.steps,
+            'total_return': round(self.total_return, 6),
+            'return_mean': round(self.return_mean, 8),
+            'return_std': round(self.return_std, 8),
+            'sharpe_ratio': round(self.sharpe_ratio, 6),
+            'peak_value': round(self.peak_value, 2),
+            'max_drawdown': round(self.max_drawdown, 6),
+            'max_drawdown_date': self.max_drawdown_date,
+            'turnover': round(self.turnover, 2),
+            'brokerage_fee': round(self.brokerage_fee, 2),
+            'win_rate': round(self.win_rate, 4),
+        }
+
+    def to_summaries(self):
+        return {
+            "episode": self.episode,
+            "steps": self.steps,
+            "available_fund": round(self.available_fund, 2),
+            "state_date": self.start_date,
+            "end_date": self.end_date,
+            "indexes": {
+                "open": {"date": self.index_open_date, "index": self.index_open},
+                "close": {"date": self.index_close_date, "index": self.index_close},
+                "high": {"date": self.index_high_date, "index": self.index_high},
+                "low": {"date": self.index_low_date, "index": self.index_low},
+            },
+            "values": {
+                "open": {"date": self.value_open_date, "value": self.value_open},
+                "close": {"date": self.value_close_date, "value": self.value_close},
+                "high": {"date": self.value_high_date, "value": self.value_high},
+                "low": {"date": self.value_low_date, "value": self.value_low},
+            },
+            "transactions": {
+                'brokerage_fee': round(self.brokerage_fee, 2),
+                "buy": {
+                    "total": self.buy_total,
+                    "fulfilled": self.buy_fulfilled,
+                },
+                "sell": {
+                    "total": self.sell_total,
+                    "fulfilled": self.sell_fulfilled,
+                },
+            },
+            "statistics": self.to_json_obj(),
+        }
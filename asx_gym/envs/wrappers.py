@@ -0,0 +1,259 @@
+import numpy as np
+from gym import Wrapper, spaces
+
+from .constants import FRAME_FIELDS
+from .datasets import STEP_DTYPE, TrajectoryShardWriter
+from .features import FeaturePipeline
+from .models import AsxAction
+
+
+class CompanyUniverse:
+    # Fixed set of companies tracked by a wrapper, company ids are mapped to
+    # dense columns so per tick state is sized by the universe, not 3000.
+    def __init__(self, company_ids, max_company_number):
+        self.company_ids = np.array(sorted(set(int(company_id) for company_id in company_ids)),
+                                    dtype=np.int64)
+        self.slots = np.full(max_company_number, -1, dtype=np.int64)
+        self.slots[self.company_ids] = np.arange(len(self.company_ids))
+
+    @classmethod
+    def from_env(cls, env, company_ids=None):
+        if company_ids is None:
+            if env.simulate_company_list:
+                company_ids = env.simulate_company_list
+            else:
+                company_ids = env.company_df.id.values
+        return cls(company_ids, env.max_company_number)
+
+    def __len__(self):
+        return len(self.company_ids)
+
+    def scatter(self, company_ids, values, out):
+        # writes values of observed companies into their universe columns
+        slots = self.slots[company_ids]
+        valid = slots >= 0
+        out[slots[valid]] = values[valid]
+        return slots[valid]
+
+
+class AsxUniversePrices:
+    # last known ask/bid/price of every company in the universe
+    def __init__(self, universe: CompanyUniverse):
+        self.universe = universe
+        size = len(universe)
+        self.ask_prices = np.zeros(size)
+        self.bid_prices = np.zeros(size)
+        self.prices = np.zeros(size)
+        self.seen = np.zeros(size, dtype=bool)
+
+    def reset(self):
+        self.ask_prices[:] = 0
+        self.bid_prices[:] = 0
+        self.prices[:] = 0
+        self.seen[:] = False
+
+    def update(self, obs):
+        count = int(obs['company_count'])
+        prices = obs['prices']
+        company_ids = prices['company_id'][:count].astype(np.int64)
+        self.universe.scatter(company_ids, prices['ask_price'][:count], self.ask_prices)
+        self.universe.scatter(company_ids, prices['bid_price'][:count], self.bid_prices)
+        slots = self.universe.scatter(company_ids, prices['price'][:count], self.prices)
+        self.seen[slots] = True
+
+
+def scatter_portfolio_volumes(universe: CompanyUniverse, obs, out):
+    count = int(obs['portfolio_company_count'])
+    portfolios = obs['portfolios']
+    out[:] = 0
+    universe.scatter(portfolios['company_id'][:count].astype(np.int64),
+                     portfolios['volume'][:count], out)
+
+
+class AsxFeatureWrapper(Wrapper):
+    """
+    Adds obs['features'], technical indicators of every company in the
+    universe updated incrementally on each tick. Columns follow
+    obs['feature_company_ids'], companies not traded yet are nan.
+
+    features: indicator names or (name, params) tuples, e.g.
+        [('sma', {'window': 20}), ('ema', {'span': 12}), 'rsi', 'atr']
+
+    The observation has no intraday high/low, so the range of a tick is
+    approximated by the quote: high = max(ask, price), low = min(bid, price).
+    ATR is therefore a spread/tick-move volatility proxy, not the daily ATR.
+    """
+
+    def __init__(self, env, features=(('return', {'period': 1}), ('sma', {'window': 20}),
+                                      ('ema', {'span': 20}), ('atr', {'period': 14}),
+                                      ('rsi', {'period': 14})),
+                 company_ids=None):
+        super().__init__(env)
+        self.universe = CompanyUniverse.from_env(self.env.unwrapped, company_ids)
+        self.universe_prices = AsxUniversePrices(self.universe)
+        self.pipeline = FeaturePipeline(features, len(self.universe))
+
+        size = len(self.universe)
+        self.observation_space = spaces.Dict(dict(self.env.observation_space.spaces))
+        self.observation_space.spaces['feature_company_ids'] = spaces.MultiDiscrete(
+            [self.env.unwrapped.max_company_number] * size)
+        self.observation_space.spaces['features'] = spaces.Dict({
+            key: spaces.Box(low=-np.inf, high=np.inf, shape=(size,), dtype=np.float32)
+            for key in self.pipeline.keys
+        })
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self.universe_prices.reset()
+        self.pipeline.reset()
+        return self._add_features(obs)
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        if obs is not None:
+            obs = self._add_features(obs)
+        return obs, reward, done, info
+
+    def _add_features(self, obs):
+        universe_prices = self.universe_prices
+        seen = universe_prices.seen.copy()
+        universe_prices.update(obs)
+        prices = universe_prices.prices
+        # tick range approximated by the quote, see the class docstring
+        high_prices = np.maximum(universe_prices.ask_prices, prices)
+        low_prices = np.minimum(np.where(universe_prices.bid_prices > 0,
+                                         universe_prices.bid_prices, prices), prices)
+        new_columns = np.flatnonzero(universe_prices.seen & ~seen)
+        if len(new_columns) > 0:
+            self.pipeline.start(new_columns, prices, high_prices, low_prices)
+        features = self.pipeline.update(prices, high_prices, low_prices)
+        unseen = ~universe_prices.seen
+        for key, values in features.items():
+            values = values.astype(np.float32)
+            values[unseen] = np.nan
+            features[key] = values
+        obs['feature_company_ids'] = self.universe.company_ids
+        obs['features'] = features
+        return obs
+
+
+class AsxFrameStackWrapper(Wrapper):
+    """
+    Adds obs['frames'], the last num_stack ticks of the universe as a
+    (num_stack, len(FRAME_FIELDS), universe) float32 array, oldest first.
+    Columns follow obs['frame_company_ids'], volume is the portfolio volume.
+
+    Frames are written twice into a circular buffer of 2 * num_stack rows so
+    the stack is always a contiguous view, it is overwritten by the next step,
+    copy it to keep it.
+    """
+
+    def __init__(self, env, num_stack=4, company_ids=None):
+        super().__init__(env)
+        self.num_stack = num_stack
+        self.universe = CompanyUniverse.from_env(self.env.unwrapped, company_ids)
+        self.universe_prices = AsxUniversePrices(self.universe)
+        self.volumes = np.zeros(len(self.universe))
+        self.buffer = np.zeros((2 * num_stack, len(FRAME_FIELDS), len(self.universe)),
+                               dtype=np.float32)
+        self.position = 0
+
+        self.observation_space = spaces.Dict(dict(self.env.observation_space.spaces))
+        self.observation_space.spaces['frame_company_ids'] = spaces.MultiDiscrete(
+            [self.env.unwrapped.max_company_number] * len(self.universe))
+        self.observation_space.spaces['frames'] = spaces.Box(
+            low=0, high=np.inf, shape=(num_stack,) + self.buffer.shape[1:],
+            dtype=np.float32)
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self.universe_prices.reset()
+        self._write_frame(obs)
+        # the first frame fills the whole stack
+        self.buffer[:] = self.buffer[self.position - 1]
+        self.position = 0
+        return self._add_frames(obs)
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        if obs is not None:
+            self._write_frame(obs)
+            obs = self._add_frames(obs)
+        return obs, reward, done, info
+
+    def _write_frame(self, obs):
+        universe_prices = self.universe_prices
+        universe_prices.update(obs)
+        scatter_portfolio_volumes(self.universe, obs, self.volumes)
+        frame = (universe_prices.ask_prices, universe_prices.bid_prices,
+                 universe_prices.prices, self.volumes)
+        for row in (self.position, self.position + self.num_stack):
+            for index, values in enumerate(frame):
+                self.buffer[row, index] = values
+        self.position = (self.position + 1) % self.num_stack
+
+    def _add_frames(self, obs):
+        obs['frame_company_ids'] = self.universe.company_ids
+        obs['frames'] = self.buffer[self.position:self.position + self.num_stack]
+        return obs
+
+
+class AsxDatasetRecorder(Wrapper):
+    """
+    Records (frame, action, reward, done) of every step into memory mapped
+    arrays under {directory}/shard_{shard}, load them with
+    datasets.TrajectoryDataset. Give each worker its own shard number.
+    """
+
+    def __init__(self, env, directory='datasets', shard=0, company_ids=None, capacity=4096):
+        super().__init__(env)
+        self.universe = CompanyUniverse.from_env(self.env.unwrapped, company_ids)
+        self.universe_prices = AsxUniversePrices(self.universe)
+        self.volumes = np.zeros(len(self.universe))
+        self.frame = np.zeros((len(FRAME_FIELDS), len(self.universe)), dtype=np.float32)
+        self.step_record = np.zeros((), dtype=STEP_DTYPE)
+        self.writer = TrajectoryShardWriter(f'{directory}/shard_{str(shard).zfill(4)}',
+                                            self.universe.company_ids, capacity)
+
+    def reset(self, **kwargs):
+        self.writer.end_episode()
+        obs = self.env.reset(**kwargs)
+        self.universe_prices.reset()
+        self.writer.start_episode(self.env.unwrapped.episode)
+        self._update_frame(obs)
+        return obs
+
+    def step(self, action):
+        asx_action = AsxAction.from_env_action(action)
+        obs, reward, done, info = self.env.step(asx_action)
+        step_record = self.step_record
+        step_record['reward'] = reward
+        step_record['done'] = done
+        step_record['end_batch'] = asx_action.end_batch
+        # the frame the action was taken on
+        self.writer.append(step_record, self.frame, asx_action.orders)
+        if done:
+            self.writer.end_episode()
+        else:
+            self._update_frame(obs)
+        return obs, reward, done, info
+
+    def close(self):
+        self.writer.end_episode()
+        self.writer.close()
+        return self.env.close()
+
+    def _update_frame(self, obs):
+        universe_prices = self.universe_prices
+        universe_prices.update(obs)
+        scatter_portfolio_volumes(self.universe, obs, self.volumes)
+        self.frame[0] = universe_prices.ask_prices
+        self.frame[1] = universe_prices.bid_prices
+        self.frame[2] = universe_prices.prices
+        self.frame[3] = self.volumes
+        step_record = self.step_record
+        step_record['day'] = obs['day']
+        step_record['second'] = obs['second']
+        step_record['total_value'] = obs['total_value']
+        step_record['available_fund'] = obs['available_fund']
+        step_record['bank_balance'] = obs['bank_balance']
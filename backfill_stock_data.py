@@ -0,0 +1,149 @@
+import argparse
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+
+from asx_gym.database import connect_writer
+from asx_gym.envs.utils import url_base
+from update_stock_data import db_file, prepare_database, load_company_ids, \
+    get_update_history, get_data_file_name, parse_data_lines, insert_data_rows
+
+DATA_NAMES = ('index', 'price')
+
+
+class LocalDirectorySource:
+    # day files laid out as {directory}/{data_name}/{year}/{month}/stock_..._{day}.csv
+    def __init__(self, directory):
+        self.directory = directory
+
+    def read(self, file_name):
+        path = os.path.join(self.directory, file_name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as data_file:
+            return data_file.read()
+
+
+class ZipArchiveSource:
+    # same layout inside a zip archive, at any depth
+    def __init__(self, archive_file):
+        self.archive = zipfile.ZipFile(archive_file)
+        self.lock = threading.Lock()
+        self.members = {}
+        for name in self.archive.namelist():
+            parts = name.split('/')
+            for index, part in enumerate(parts):
+                if part in DATA_NAMES:
+                    self.members['/'.join(parts[index:])] = name
+                    break
+
+    def read(self, file_name):
+        name = self.members.get(file_name)
+        if name is None:
+            return None
+        with self.lock:
+            return self.archive.read(name).decode('utf-8')
+
+
+class HttpSource:
+    # any server with the asx_data_daily layout, a local http.server works too
+    def __init__(self, base_url=url_base):
+        self.base_url = base_url if base_url.endswith('/') else f'{base_url}/'
+        self.sessions = threading.local()
+
+    def read(self, file_name):
+        session = getattr(self.sessions, 'session', None)
+        if session is None:
+            session = self.sessions.session = requests.Session()
+        r = session.get(f'{self.base_url}{file_name}', timeout=60)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.text
+
+
+def open_source(source):
+    if source.startswith('http://') or source.startswith('https://'):
+        return HttpSource(source)
+    if source.endswith('.zip'):
+        return ZipArchiveSource(source)
+    return LocalDirectorySource(source)
+
+
+def trading_days(start_date, end_date):
+    # weekdays only, public holidays simply have no day file
+    day = start_date
+    while day <= end_date:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def backfill_data(conn, source, data_name, start_date, end_date, company_ids, workers=8):
+    def fetch(day):
+        text = source.read(get_data_file_name(data_name, day))
+        if not text or not text.strip():
+            return None
+        return parse_data_lines(data_name, text.splitlines(), company_ids)
+
+    days = list(trading_days(start_date, end_date))
+    print(f'Backfilling {data_name} from {start_date} to {end_date}, {len(days)} days')
+    total_created = 0
+    chunk_size = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # days are fetched concurrently but committed in date order, so the
+        # checkpoint in stock_dataupdatehistory is always a completed day
+        for chunk_start in range(0, len(days), chunk_size):
+            chunk = days[chunk_start:chunk_start + chunk_size]
+            for day, rows in zip(chunk, executor.map(fetch, chunk)):
+                if rows is None:
+                    continue
+                day_str = day.strftime('%Y-%m-%d')
+                created = insert_data_rows(conn, data_name, rows, day_str)
+                total_created += created
+                print(f'{data_name} {day_str}: {created} of {len(rows)} rows created')
+    return total_created
+
+
+def backfill(conn, source, data_names=DATA_NAMES, start_date=None, end_date=None, workers=8):
+    prepare_database(conn)
+    company_ids = load_company_ids(conn)
+    updated_dates = {data_name: updated_date for data_name, updated_date in get_update_history(conn)}
+    if end_date is None:
+        end_date = date.today() + timedelta(days=-1)
+    for data_name in data_names:
+        first_date = start_date
+        if first_date is None:
+            # resume after the last completed day
+            if not updated_dates.get(data_name):
+                raise ValueError(f'No {data_name} data yet, a start date is needed')
+            first_date = datetime.strptime(updated_dates[data_name], '%Y-%m-%d').date() \
+                + timedelta(days=1)
+        backfill_data(conn, source, data_name, first_date, end_date, company_ids, workers)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill daily stock and index data')
+    parser.add_argument('--source', default=url_base,
+                        help='data directory, zip archive or http base url')
+    parser.add_argument('--db', default=db_file)
+    parser.add_argument('--data', choices=DATA_NAMES, action='append',
+                        help='index or price, both by default')
+    parser.add_argument('--start', type=parse_date,
+                        help='first day (yyyy-mm-dd), the day after the last update by default')
+    parser.add_argument('--end', type=parse_date, help='last day (yyyy-mm-dd), yesterday by default')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    conn = connect_writer(args.db)
+    backfill(conn, open_source(args.source), tuple(args.data or DATA_NAMES),
+             args.start, args.end, args.workers)
+    conn.close()
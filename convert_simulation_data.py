@@ -0,0 +1,13 @@
+import pathlib
+import sys
+
+from asx_gym.envs.constants import DAILY_SIMULATION_FILE_NAME, TEMPLATE_LIBRARY_DIRECTORY_NAME
+from asx_gym.envs.simulation_templates import build_template_library
+
+data_directory = f'{pathlib.Path().absolute()}/asx_gym'
+csv_file = sys.argv[1] if len(sys.argv) > 1 else f'{data_directory}/{DAILY_SIMULATION_FILE_NAME}'
+output_directory = sys.argv[2] if len(sys.argv) > 2 else f'{data_directory}/{TEMPLATE_LIBRARY_DIRECTORY_NAME}'
+
+print(f'Converting {csv_file} to {output_directory}')
+library = build_template_library(csv_file, output_directory)
+print(f'{library.template_count} templates, {len(library.prices)} ticks written')
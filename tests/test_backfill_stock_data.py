@@ -0,0 +1,59 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date
+
+from backfill_stock_data import LocalDirectorySource, backfill
+from update_stock_data import get_data_file_name
+
+SCHEMA_SQL = '''
+CREATE TABLE stock_company(id integer PRIMARY KEY, code varchar(16));
+CREATE TABLE stock_stockpricedailyhistory(id integer PRIMARY KEY AUTOINCREMENT, name, price_date date,
+    open_price decimal, close_price decimal, high_price decimal, low_price decimal, volume decimal,
+    company_id integer, created_at, updated_at, removed);
+CREATE TABLE stock_asxindexdailyhistory(id integer PRIMARY KEY AUTOINCREMENT, name, index_name,
+    index_date date, open_index decimal, close_index decimal, high_index decimal, low_index decimal,
+    created_at, updated_at, removed);
+CREATE TABLE stock_dataupdatehistory(id integer PRIMARY KEY AUTOINCREMENT, data_name, updated_date date);
+INSERT INTO stock_company(id, code) VALUES (1, 'ASX:CBA');
+'''
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.conn = sqlite3.connect(os.path.join(self.directory, 'db.sqlite3'))
+        self.conn.executescript(SCHEMA_SQL)
+        self.source = LocalDirectorySource(os.path.join(self.directory, 'data'))
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def write_day(self, day):
+        day_str = day.strftime('%Y-%m-%d')
+        lines = {'index': f'ASX20,{day_str},1,2,3,0.5\n',
+                 'price': f'CBA,{day_str},1,2,3,0.5,100\n'}
+        for data_name, line in lines.items():
+            path = os.path.join(self.source.directory, get_data_file_name(data_name, day))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as data_file:
+                data_file.write(line)
+
+    def update_history(self):
+        return dict(self.conn.execute('SELECT data_name,updated_date FROM stock_dataupdatehistory'))
+
+    def test_fresh_database_backfill_then_resume(self):
+        for day in (date(2020, 5, 4), date(2020, 5, 5), date(2020, 5, 6)):
+            self.write_day(day)
+        backfill(self.conn, self.source, start_date=date(2020, 5, 4), end_date=date(2020, 5, 5),
+                 workers=2)
+        self.assertEqual(self.update_history(), {'index': '2020-05-05', 'price': '2020-05-05'})
+
+        # no start date, resumes after the checkpoint
+        backfill(self.conn, self.source, end_date=date(2020, 5, 6), workers=2)
+        self.assertEqual(self.update_history(), {'index': '2020-05-06', 'price': '2020-05-06'})
+        self.assertEqual(self.conn.execute(
+            'SELECT count(*) FROM stock_stockpricedailyhistory').fetchone()[0], 3)
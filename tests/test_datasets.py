@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from asx_gym.envs.constants import BUY_STOCK, FRAME_FIELDS
+from asx_gym.envs.datasets import STEP_DTYPE, TrajectoryDataset, TrajectoryShardWriter
+from asx_gym.envs.models import ORDER_DTYPE
+
+COMPANY_IDS = [2, 5, 9]
+
+
+def record_episode(writer, episode, length, value):
+    writer.start_episode(episode)
+    for step in range(length):
+        step_record = np.zeros((), dtype=STEP_DTYPE)
+        step_record['day'] = step
+        step_record['done'] = step == length - 1
+        frame = np.full((len(FRAME_FIELDS), len(COMPANY_IDS)), value + step, dtype=np.float32)
+        orders = np.zeros(1, dtype=ORDER_DTYPE)
+        orders[0] = (2, BUY_STOCK, value, 1.0)
+        writer.append(step_record, frame, orders)
+    writer.end_episode()
+
+
+class TrajectoryShardWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shard_directory = f'{self.directory}/shard_0000'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restart_resumes_the_shard(self):
+        writer = TrajectoryShardWriter(self.shard_directory, COMPANY_IDS, capacity=2)
+        record_episode(writer, 1, 3, 10)
+        writer.close()
+
+        writer = TrajectoryShardWriter(self.shard_directory, COMPANY_IDS, capacity=2)
+        record_episode(writer, 1, 2, 100)
+        # not ended, discarded when the shard is reopened
+        writer.start_episode(2)
+        writer.append(np.zeros((), dtype=STEP_DTYPE),
+                      np.zeros((len(FRAME_FIELDS), len(COMPANY_IDS)), dtype=np.float32),
+                      np.zeros(0, dtype=ORDER_DTYPE))
+        writer.flush()
+        del writer
+
+        writer = TrajectoryShardWriter(self.shard_directory, COMPANY_IDS)
+        writer.close()
+        dataset = TrajectoryDataset(self.directory)
+        self.assertEqual(len(dataset), 5)
+        batch = dataset.get_batch(np.arange(5), with_orders=True)
+        np.testing.assert_array_equal(batch['frames'][:, 0, 0], [10, 11, 12, 100, 101])
+        self.assertEqual([orders[0]['volume'] for orders in batch['orders']],
+                         [10, 10, 10, 100, 100])
+        shard = dataset.shards[0]
+        np.testing.assert_array_equal(shard.episodes['episode'], [1, 2])
+        np.testing.assert_array_equal(shard.episodes['start'], [0, 3])
+
+    def test_other_universe_is_rejected(self):
+        TrajectoryShardWriter(self.shard_directory, COMPANY_IDS).close()
+        with self.assertRaises(ValueError):
+            TrajectoryShardWriter(self.shard_directory, [1, 2])
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from asx_gym.envs.constants import BUY_STOCK, SELL_STOCK
+from asx_gym.envs.execution import BrokerageFeeTable, greedy_accept, match_orders
+from asx_gym.envs.models import TransactionFee
+
+
+def sequential_accept(keys, costs, budgets):
+    remaining = {}
+    accepted = []
+    for key, cost, budget in zip(keys, costs, budgets):
+        left = remaining.get(key, budget)
+        accepted.append(cost <= left)
+        remaining[key] = left - cost if cost <= left else left
+    return np.array(accepted, dtype=bool)
+
+
+def match(stock_operations, volumes, holdings=None, available_fund=500.0,
+          company_ids=None, fee_table=None):
+    count = len(stock_operations)
+    return match_orders(np.array(stock_operations),
+                        np.array(company_ids or [1] * count),
+                        np.full(count, 10.0), np.array(volumes, dtype=np.float64),
+                        np.full(count, 10.0), np.full(count, 10.0),
+                        np.array(holdings or [0.0] * count, dtype=np.float64),
+                        np.ones(count, dtype=bool), available_fund,
+                        fee_table or BrokerageFeeTable([]))
+
+
+class GreedyAcceptTest(unittest.TestCase):
+    def test_matches_sequential_acceptance(self):
+        random = np.random.RandomState(0)
+        for _ in range(200):
+            count = random.randint(1, 30)
+            keys = random.randint(0, 4, size=count)
+            costs = random.randint(1, 50, size=count).astype(np.float64)
+            budgets = np.array([100.0, 60.0, 20.0, 0.0])[keys]
+            accepted, _ = greedy_accept(keys, costs, budgets)
+            np.testing.assert_array_equal(accepted, sequential_accept(keys, costs, budgets))
+
+
+class MatchOrdersTest(unittest.TestCase):
+    def test_rejected_buy_does_not_block_later_buys(self):
+        execution = match([BUY_STOCK, BUY_STOCK, BUY_STOCK], [1000, 1, 40])
+        np.testing.assert_array_equal(execution.buy_fulfilled, [False, True, True])
+        self.assertAlmostEqual(execution.available_fund, 90.0)
+
+    def test_partial_acceptance_keeps_submission_order(self):
+        execution = match([BUY_STOCK] * 4, [30, 30, 10, 5])
+        np.testing.assert_array_equal(execution.buy_fulfilled, [True, False, True, True])
+        self.assertAlmostEqual(execution.available_fund, 50.0)
+
+    def test_rejected_sell_does_not_block_later_sells(self):
+        execution = match([SELL_STOCK, SELL_STOCK, SELL_STOCK], [100, 10, 45],
+                          holdings=[50, 50, 50], available_fund=0.0)
+        np.testing.assert_array_equal(execution.sell_fulfilled, [False, True, False])
+        self.assertAlmostEqual(execution.available_fund, 100.0)
+
+    def test_sells_are_limited_per_company(self):
+        execution = match([SELL_STOCK, SELL_STOCK, SELL_STOCK], [30, 30, 30],
+                          holdings=[50, 40, 50], company_ids=[1, 2, 1], available_fund=0.0)
+        np.testing.assert_array_equal(execution.sell_fulfilled, [True, True, False])
+
+
+class BrokerageFeeTableTest(unittest.TestCase):
+    def test_unsorted_tiers(self):
+        fee_table = BrokerageFeeTable([TransactionFee(1e9, 0.1, True),
+                                       TransactionFee(1000, 10, False),
+                                       TransactionFee(5000, 20, False)])
+        np.testing.assert_allclose(fee_table.calculate([500, 3000, 10000]), [10, 20, 10])
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from asx_gym.envs.constants import BUY_STOCK
+from asx_gym.envs.models import AsxAction, ORDER_DTYPE
+from asx_gym.envs.serializers import FORMAT_BINARY, FORMAT_NDJSON, StepDeserializer, \
+    StepSerializer
+
+
+def make_observation(prices):
+    company_ids = sorted(prices)
+    return {
+        'day': np.array(3),
+        'second': np.array(900),
+        'company_count': len(company_ids),
+        'prices': {
+            'company_id': np.array(company_ids),
+            'ask_price': np.array([prices[company_id][0] for company_id in company_ids]),
+            'bid_price': np.array([prices[company_id][1] for company_id in company_ids]),
+            'price': np.array([prices[company_id][2] for company_id in company_ids]),
+        },
+        'portfolio_company_count': 1,
+        'portfolios': {
+            'company_id': np.array([2]),
+            'volume': np.array([100.0]),
+            'buy_price': np.array([1.5]),
+            'sell_price': np.array([0.0]),
+            'price': np.array([1.75]),
+        },
+        'total_value': np.array(100175.0),
+        'available_fund': np.array(100000.0),
+        'bank_balance': np.array(0.0),
+        'indexes': {'open': np.array(6000.0), 'close': np.array(6010.0),
+                    'high': np.array(6020.0), 'low': np.array(5990.0)},
+    }
+
+
+class StepSerializerTest(unittest.TestCase):
+    def round_trip(self, format):
+        serializer = StepSerializer(format)
+        deserializer = StepDeserializer(format)
+        orders = np.zeros(1, dtype=ORDER_DTYPE)
+        orders[0] = (2, BUY_STOCK, 100, 1.75)
+        extra = {'date_time': '2020-05-04 10:15:00',
+                 'transactions': [{'company_id': 2, 'volume': 100, 'price': 1.75}]}
+        first = deserializer.decode(serializer.encode(
+            make_observation({1: [1.0, 0.5, 0.75], 2: [2.0, 1.5, 1.75]}),
+            AsxAction(1, orders), 10.0, extra))
+        second = deserializer.decode(serializer.encode(
+            make_observation({1: [1.0, 0.5, 0.75], 2: [2.5, 2.0, 2.25]})))
+        return first, second, extra
+
+    def test_round_trip_formats_are_equivalent(self):
+        for format in (FORMAT_NDJSON, FORMAT_BINARY):
+            with self.subTest(format=format):
+                first, second, extra = self.round_trip(format)
+                self.assertEqual(first['date_time'], extra['date_time'])
+                self.assertEqual(first['transactions'], extra['transactions'])
+                self.assertEqual(first['action']['end_batch'], 1)
+                self.assertEqual(first['action']['orders'][0][:2], [2, BUY_STOCK])
+                self.assertNotIn('date_time', second)
+                # the second record is a delta, decoded back to a full snapshot
+                self.assertTrue(second['delta'])
+                self.assertEqual(sorted(second['prices']), [1, 2])
+                np.testing.assert_allclose(second['prices'][2], [2.5, 2.0, 2.25])
+                np.testing.assert_allclose(second['portfolios'][2], [100.0, 1.5, 0.0, 1.75])
@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from asx_gym.envs.simulation_templates import build_template_library, bridgeable, \
+    generate_bridge_prices
+
+
+class SimulationTemplateLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rows = [(1, day, tick, 0.95 + 0.005 * tick, 0.94 + 0.005 * tick, 0.945 + 0.005 * tick,
+                 0.9, 1.0) for day in range(2) for tick in range(10)]
+        csv_file = f'{self.directory}/daily_stock_price.csv'
+        pd.DataFrame(rows).to_csv(csv_file, index=False)
+        self.library = build_template_library(csv_file, f'{self.directory}/library')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sample(self):
+        prices = self.library.sample(0.9)
+        self.assertEqual(prices.shape, (10, 3))
+
+    def test_sample_non_finite_ratio(self):
+        # high of 0 or missing, the env keeps the flat fallback
+        self.assertIsNone(self.library.sample(float('nan'), 1.0))
+        self.assertIsNone(self.library.sample(float('inf'), 1.0))
+
+
+class BridgePricesTest(unittest.TestCase):
+    def test_bridgeable(self):
+        np.testing.assert_array_equal(bridgeable([10.0, 0.0, float('nan'), 5.0],
+                                                 [9.0, 0.0, 1.0, float('nan')]),
+                                      [True, False, False, False])
+
+    def test_prices_within_day_range(self):
+        prices = generate_bridge_prices([9.5], [9.8], [10.0], [9.0], np.random.RandomState(0),
+                                        ask_spreads=[0.01], bid_spreads=[0.01])
+        self.assertTrue(np.isfinite(prices).all())
+        self.assertAlmostEqual(prices[0, :, 2].max(), 1.0)
+        self.assertAlmostEqual(prices[0, :, 2].min(), 0.9)
+        np.testing.assert_allclose(prices[0, :, 0], prices[0, :, 2] * 1.01)
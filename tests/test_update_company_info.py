@@ -0,0 +1,60 @@
+import sqlite3
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from update_company_info import update_company_info
+
+SCHEMA_SQL = '''
+CREATE TABLE stock_sector(id integer PRIMARY KEY AUTOINCREMENT, name, full_name, created_at, updated_at,
+    removed, number_of_companies, sector_id, sector_index, sector_type, parent_sector_id integer,
+    lft, rght, tree_id, sector_level);
+CREATE TABLE stock_company(id integer PRIMARY KEY AUTOINCREMENT, name, description, created_at,
+    updated_at, removed, code, market_capacity, sector_id integer);
+'''
+
+
+def sector(pk, name, parent=None):
+    return {'pk': pk, 'fields': {'name': name, 'full_name': name, 'created_at': '2020-01-01',
+                                 'updated_at': '2020-01-01', 'removed': False,
+                                 'number_of_companies': 1, 'sector_id': pk, 'sector_index': None,
+                                 'sector_type': 'GICS', 'parent_sector': parent}}
+
+
+def company(code, sector_pk, market_capacity=100):
+    return {'fields': {'name': code, 'description': '', 'created_at': '2020-01-01',
+                       'updated_at': '2020-01-01', 'removed': False, 'code': f'ASX:{code}',
+                       'market_capacity': market_capacity, 'sector': sector_pk}}
+
+
+class UpdateCompanyInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript(SCHEMA_SQL)
+        self.sectors = [sector(10, 'Financials'), sector(11, 'Banks', 10), sector(12, 'Insurance', 10)]
+
+    def tearDown(self):
+        self.conn.close()
+
+    def run_update(self, companies):
+        output = StringIO()
+        with redirect_stdout(output):
+            update_company_info(self.conn, self.sectors, companies)
+        return output.getvalue().splitlines()
+
+    def test_first_run_reports_only_created_rows(self):
+        lines = self.run_update([company('CBA', 11), company('QBE', 12)])
+        self.assertEqual(lines, ['sectors: 3 created, 0 updated', 'companies: 2 created, 0 updated'])
+        parents = dict(self.conn.execute('SELECT name, parent_sector_id FROM stock_sector'))
+        financials = self.conn.execute("SELECT id FROM stock_sector WHERE name='Financials'").fetchone()[0]
+        self.assertEqual(parents, {'Financials': None, 'Banks': financials, 'Insurance': financials})
+
+    def test_second_run_reports_changed_rows(self):
+        self.run_update([company('CBA', 11), company('QBE', 12)])
+        self.sectors[2]['fields']['number_of_companies'] = 2
+        lines = self.run_update([company('CBA', 11, 200), company('QBE', 12), company('IAG', 12)])
+        self.assertEqual(lines, ['sectors: 0 created, 1 updated', 'companies: 1 created, 1 updated'])
+
+
+if __name__ == '__main__':
+    unittest.main()
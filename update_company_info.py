@@ -1,85 +1,154 @@
+from asx_gym.database import connect_writer
 from asx_gym.envs.utils import create_directory_if_not_exist, download_file
 import json
-import sqlite3
 
 db_file = './asx_gym/db.sqlite3'
 
-create_directory_if_not_exist('data/company')
-company_file = 'company/companies.json'
-download_file(company_file)
-sector_file = 'company/sectors.json'
-download_file(sector_file)
-
-conn = sqlite3.connect(db_file)
-
-cur = conn.cursor()
-
-with open('data/company/sectors.json') as f:
-    sectors = json.load(f)
-    for sector in sectors:
-        name = sector['fields']['name']
-        cur.execute(f'SELECT count(*) FROM stock_sector WHERE name="{name}"')
-        row = cur.fetchone()[0]
-        full_name = sector['fields']['full_name']
-        if row == 0:
-            name = sector['fields']['name']
-            parent_sector = sector['fields']['parent_sector']
-            created_at = sector['fields']['created_at']
-            updated_at = sector['fields']['updated_at']
-            removed = sector['fields']['removed']
-            sector_type = sector['fields']['sector_type']
-            sector_id = sector['fields']['sector_id']
-            sector_index = sector['fields']['sector_index']
-            number_of_companies = sector['fields']['number_of_companies']
-            lft = sector['fields']['lft']
-            rght = sector['fields']['rght']
-            tree_id = sector['fields']['tree_id']
-            sector_level = sector['fields']['sector_level']
-            sql = '''
-                INSERT INTO stock_sector(name,full_name,created_at,updated_at,
-                removed,lft,rght,tree_id,sector_level,number_of_companies,
-                sector_id,sector_index,sector_type,parent_sector_id)
-                VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            '''
-            cur.execute(sql, (name, full_name, created_at, updated_at,
-                              removed, lft, rght, tree_id, sector_level, number_of_companies,
-                              sector_id, sector_index, sector_type, parent_sector))
-            conn.commit()
-            print(f'sector {full_name} created')
-        else:
-            print(f'sector {full_name} exists')
-
-with open('data/company/companies.json') as f:
-    companies = json.load(f)
+SECTOR_FIELDS = ['name', 'full_name', 'created_at', 'updated_at', 'removed', 'number_of_companies',
+                 'sector_id', 'sector_index', 'sector_type', 'parent_sector_id']
+# fields compared to decide whether an existing row needs an update
+SECTOR_UPDATE_FIELDS = ['full_name', 'removed', 'number_of_companies', 'sector_id',
+                        'sector_index', 'sector_type', 'parent_sector_id']
+SECTOR_TREE_FIELDS = ['lft', 'rght', 'tree_id', 'sector_level']
+COMPANY_FIELDS = ['name', 'description', 'created_at', 'updated_at', 'removed', 'code',
+                  'market_capacity', 'sector_id']
+COMPANY_UPDATE_FIELDS = ['name', 'description', 'removed', 'market_capacity', 'sector_id']
+
+
+def download_company_files():
+    create_directory_if_not_exist('data/company')
+    download_file('company/companies.json')
+    download_file('company/sectors.json')
+
+
+def load_rows(conn, table, key, fields):
+    cur = conn.cursor()
+    cur.execute(f'SELECT id,{",".join(fields)} FROM {table}')
+    columns = ['id'] + fields
+    return {row[columns.index(key)]: dict(zip(columns, row)) for row in cur.fetchall()}
+
+
+def normalize_value(value):
+    # sqlite returns 0/1 for booleans and numbers for decimal json strings
+    if isinstance(value, bool):
+        return int(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def diff_rows(records, existing, key, update_fields):
+    # returns (rows to insert, rows to update), compared in memory
+    inserts = []
+    updates = []
+    for record in records:
+        row = existing.get(record[key])
+        if row is None:
+            inserts.append(record)
+        elif any(normalize_value(row[field]) != normalize_value(record[field])
+                 for field in update_fields):
+            record['id'] = row['id']
+            updates.append(record)
+    return inserts, updates
+
+
+def execute_upsert(conn, table, fields, update_fields, inserts, updates):
+    if inserts:
+        insert_sql = f'INSERT INTO {table}({",".join(fields)}) ' \
+                     f'VALUES({",".join("?" * len(fields))})'
+        conn.executemany(insert_sql, [[record[field] for field in fields] for record in inserts])
+    if updates:
+        update_fields = update_fields + ['updated_at']
+        update_sql = f'UPDATE {table} SET {",".join(f"{field}=?" for field in update_fields)} ' \
+                     f'WHERE id=?'
+        conn.executemany(update_sql, [[record[field] for field in update_fields] + [record['id']]
+                                      for record in updates])
+
+
+def rebuild_sector_tree(conn):
+    # django-mptt fields for the whole stock_sector table in one pass,
+    # roots and children ordered by name (MPTTMeta.order_insertion_by)
+    cur = conn.cursor()
+    cur.execute('SELECT id,name,parent_sector_id FROM stock_sector')
+    children = {}
+    for sector_id, name, parent_sector_id in cur.fetchall():
+        children.setdefault(parent_sector_id, []).append((name, sector_id))
+    tree_rows = []
+
+    def visit(sector_id, tree_id, level, lft):
+        rght = lft + 1
+        for _, child_id in sorted(children.get(sector_id, [])):
+            rght = visit(child_id, tree_id, level + 1, rght) + 1
+        tree_rows.append((lft, rght, tree_id, level, sector_id))
+        return rght
+
+    for tree_id, (_, root_id) in enumerate(sorted(children.get(None, [])), start=1):
+        visit(root_id, tree_id, 0, 1)
+    conn.executemany('UPDATE stock_sector SET lft=?,rght=?,tree_id=?,sector_level=? WHERE id=?',
+                     tree_rows)
+
+
+def update_sectors(conn, sectors):
+    # parent sectors refer to primary keys of the json, they are resolved through names
+    source_names = {sector['pk']: sector['fields']['name'] for sector in sectors if 'pk' in sector}
+    records = [{field: sector['fields'].get(field) for field in SECTOR_FIELDS}
+               for sector in sectors]
+
+    # new sectors are inserted without parent first, so every parent has a local id,
+    # the tree fields are placeholders until the rebuild
+    existing = load_rows(conn, 'stock_sector', 'name', SECTOR_FIELDS)
+    inserts, _ = diff_rows(records, existing, 'name', [])
+    execute_upsert(conn, 'stock_sector', SECTOR_FIELDS + SECTOR_TREE_FIELDS, [],
+                   [dict(record, parent_sector_id=None, lft=0, rght=0, tree_id=0, sector_level=0)
+                    for record in inserts], [])
+
+    existing = load_rows(conn, 'stock_sector', 'name', SECTOR_FIELDS)
+    for record, sector in zip(records, sectors):
+        parent = sector['fields']['parent_sector']
+        if parent in source_names:
+            parent = existing[source_names[parent]]['id']
+        record['parent_sector_id'] = parent
+    _, updates = diff_rows(records, existing, 'name', SECTOR_UPDATE_FIELDS)
+    execute_upsert(conn, 'stock_sector', SECTOR_FIELDS, SECTOR_UPDATE_FIELDS, [], updates)
+    rebuild_sector_tree(conn)
+    # sectors inserted above only receive their parent here, they are not reported as updated
+    inserted_names = {record['name'] for record in inserts}
+    updated = sum(1 for record in updates if record['name'] not in inserted_names)
+    print(f'sectors: {len(inserts)} created, {updated} updated')
+    return source_names
+
+
+def update_companies(conn, companies, source_sector_names):
+    existing = load_rows(conn, 'stock_company', 'code', COMPANY_FIELDS)
+    sector_ids = {name: row['id'] for name, row in load_rows(conn, 'stock_sector', 'name',
+                                                             ['name']).items()}
+    records = []
     for company in companies:
-        name = company['fields']['name']
-        code = company['fields']['code']
-        cur.execute(f'SELECT count(*) FROM stock_company WHERE code="{code}"')
-        row = cur.fetchone()[0]
-
-        if row == 0:
-            description = company['fields']['description']
-            created_at = company['fields']['created_at']
-            updated_at = company['fields']['updated_at']
-            removed = company['fields']['removed']
-            sector = company['fields']['sector']
-            code = company['fields']['code']
-            market_capacity = company['fields']['market_capacity']
-            sql = '''
-             INSERT INTO stock_company(name,description,created_at,updated_at,
-             removed,code,market_capacity,sector_id) 
-             VALUES(?,?,?,?,?,?,?,?)
-            '''
-            try:
-                cur.execute(sql, (name, description, created_at, updated_at,
-                                  removed, code, market_capacity, sector))
-
-                conn.commit()
-            except Exception as e:
-                print(name)
-                raise e
-            print(f'company {name} created')
-        else:
-            print(f'company {name} exists')
-
-conn.close()
+        record = {field: company['fields'].get(field) for field in COMPANY_FIELDS}
+        sector = company['fields']['sector']
+        if sector is not None and sector in source_sector_names:
+            sector = sector_ids.get(source_sector_names[sector])
+        record['sector_id'] = sector
+        records.append(record)
+    inserts, updates = diff_rows(records, existing, 'code', COMPANY_UPDATE_FIELDS)
+    execute_upsert(conn, 'stock_company', COMPANY_FIELDS, COMPANY_UPDATE_FIELDS, inserts, updates)
+    print(f'companies: {len(inserts)} created, {len(updates)} updated')
+
+
+def update_company_info(conn, sectors, companies):
+    # everything is applied in one transaction
+    with conn:
+        source_sector_names = update_sectors(conn, sectors)
+        update_companies(conn, companies, source_sector_names)
+
+
+if __name__ == '__main__':
+    download_company_files()
+    conn = connect_writer(db_file)
+    with open('data/company/sectors.json') as f:
+        sectors = json.load(f)
+    with open('data/company/companies.json') as f:
+        companies = json.load(f)
+    update_company_info(conn, sectors, companies)
+    conn.close()
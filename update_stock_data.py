@@ -1,5 +1,5 @@
-import sqlite3
 from datetime import date, datetime, timedelta
+from asx_gym.database import connect_writer
 from asx_gym.envs.utils import create_directory_if_not_exist, download_file
 import os
 
@@ -14,142 +14,298 @@ stock_index_codes = {
     'ALL ORD': 'xao',
 }
 
+# same unique indexes as the stock app migration 0007, created here as well
+# for databases that were not migrated by django
+CREATE_UNIQUE_INDEX_SQLS = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS stock_price_daily_company_date_uniq '
+    'ON stock_stockpricedailyhistory(company_id,price_date)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS stock_index_daily_name_date_uniq '
+    'ON stock_asxindexdailyhistory(index_name,index_date)',
+]
 
-def insert_stock_price_history(conn, line):
-    try:
-        values = line.split(',')
-        code = values[0].strip()
-        price_date = values[1].strip()
-        price_open = values[2].strip()
-        price_close = values[3].strip()
-        price_high = values[4].strip()
-        price_low = values[5].strip()
-        stock_volume = values[6].strip()
-        name = f'{code}:{price_date}'
-
-        cur = conn.cursor()
-        cur.execute(f'SELECT count(*) FROM stock_stockpricedailyhistory WHERE name="{name}"')
-        row = cur.fetchone()[0]
-        if row == 0:
-            company_code = f'ASX:{code.upper()}'
-            cur.execute(f'SELECT id FROM stock_company WHERE code="{company_code}"')
-            company = cur.fetchone()
-            if company:
-                company_id = company[0]
-                sql = '''
-                    INSERT INTO 
-                    stock_stockpricedailyhistory(name,price_date,open_price,
-                    close_price,high_price,low_price,volume,company_id,created_at,updated_at,removed)
-                    VALUES(?,?,?,?,?,?,?,?,?,?,?)
-                '''
-                cur.execute(sql,
-                            (name, price_date, price_open, price_close,
-                             price_high, price_low, stock_volume, company_id,
-                             datetime.now(), datetime.now(), False))
-                print(f'{code}-{price_date}-{price_open}-{price_close}-{price_high}-{price_low}-{stock_volume} created')
-                conn.commit()
-        else:
-            print(f'{code}-{price_date}-{price_open}-{price_close}-{price_high}-{price_low}-{stock_volume} exists')
-    except Exception as e:
-        print(f'{line}-{str(e)}')
-
-
-def insert_stock_index_history(conn, line):
-    try:
-        values = line.split(',')
-        code = values[0].strip()
-        index_date = values[1].strip()
-        index_open = values[2].strip()
-        index_close = values[3].strip()
-        index_high = values[4].strip()
-        index_low = values[5].strip()
-        name = f'{stock_index_codes[code]}:{index_date}'
-
-        cur = conn.cursor()
-        cur.execute(f'SELECT count(*) FROM stock_asxindexdailyhistory WHERE name="{name}"')
-        row = cur.fetchone()[0]
-        if row == 0:
-            sql = '''
-                        INSERT INTO 
-                        stock_asxindexdailyhistory(name,index_name,index_date,open_index,
-                        close_index,high_index,low_index,created_at,updated_at,removed)
-                        VALUES(?,?,?,?,?,?,?,?,?,?)
-                    '''
-            cur.execute(sql,
-                        (name, code, index_date, index_open, index_close,
-                         index_high, index_low,
-                         datetime.now(), datetime.now(), False))
-            print(f'{code}-{index_date}-{index_open}-{index_close}-{index_high}-{index_low} created')
-            conn.commit()
-
-        else:
-            print(f'{code}-{index_date}-{index_open}-{index_close}-{index_high}-{index_low} exists')
-
-    except Exception as e:
-        print(f'{line}-{str(e)}')
-
-
-conn = sqlite3.connect(db_file)
-
-cur = conn.cursor()
-cur.execute("SELECT data_name,updated_date FROM stock_dataupdatehistory")
-rows = cur.fetchall()
-
-if len(rows) == 0:
-    cur.execute("select max(index_date) from stock_asxindexdailyhistory")
-    data_date = cur.fetchone()
-    rows.append(['index', data_date[0]])
-    cur.execute(
-        f'INSERT INTO stock_dataupdatehistory(updated_date,data_name) VALUES ("{data_date[0]}","index")')
-    conn.commit()
-    cur.execute("select max(price_date) from stock_stockpricedailyhistory")
-    data_date = cur.fetchone()
-    rows.append(['price', data_date[0]])
-
-    cur.execute(
-        f'INSERT INTO stock_dataupdatehistory(updated_date,data_name) VALUES ("{data_date[0]}","price")')
-    conn.commit()
-
-for row in rows:
-    data_name = row[0]
-    update_date_str = row[1]
-    update_date = datetime.strptime(update_date_str, '%Y-%m-%d').date()
-    today = date.today()
-    days = (today - update_date).days
-
-    for day in range(-days + 1, 0):
-        retrieve_date = today + timedelta(days=day)
-        retrieve_date_str = retrieve_date.strftime('%Y-%m-%d')
-
-        dates = retrieve_date_str.split('-')
-        year = dates[0].zfill(2)
-        month = dates[1].zfill(2)
-        day = dates[2].zfill(2)
-
-        file_name = f'{data_name}/{year}/{month}/stock_{data_name}_{year}_{month}_{day}.csv'
-        print(f'Downloading {file_name}')
-        create_directory_if_not_exist(f'data/{data_name}/{year}/{month}')
-        download_file(file_name)
-
-        data_file = open(f'data/{file_name}')
-        line = data_file.readline().strip()
-        if line == '':
-            data_file.close()
-            os.remove(f'data/{file_name}')
-        else:
-
-            while line:
-                if data_name == 'index':
-                    insert_stock_index_history(conn, line)
-                else:
-                    insert_stock_price_history(conn, line)
-                line = data_file.readline()
-
-            cur.execute(
-                f'UPDATE stock_dataupdatehistory SET updated_date="{retrieve_date_str}" WHERE data_name="{data_name}"')
-            conn.commit()
-            print(f'{data_name} last updated date set to {retrieve_date_str}')
-
-            data_file.close()
-
-conn.close()
+# existing rows are skipped by the unique indexes, no lookup per line
+INSERT_STOCK_PRICE_SQL = '''
+    INSERT INTO
+    stock_stockpricedailyhistory(name,price_date,open_price,
+    close_price,high_price,low_price,volume,company_id,created_at,updated_at,removed)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT DO NOTHING
+'''
+
+INSERT_STOCK_INDEX_SQL = '''
+    INSERT INTO
+    stock_asxindexdailyhistory(name,index_name,index_date,open_index,
+    close_index,high_index,low_index,created_at,updated_at,removed)
+    VALUES(?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT DO NOTHING
+'''
+
+
+# data name -> (daily table, key column, date column, rollup table), the rollup
+# tables are created by the stock app migration 0008
+DAILY_TABLES = {
+    'index': ('stock_asxindexdailyhistory', 'index_name', 'index_date',
+              'stock_asxindexrolluphistory'),
+    'price': ('stock_stockpricedailyhistory', 'company_id', 'price_date',
+              'stock_stockpricerolluphistory'),
+}
+
+# sqlite date expressions of the period a day belongs to, weeks start on monday
+ROLLUP_PERIODS = {
+    'weekly': "date({}, 'weekday 0', '-6 days')",
+    'monthly': "date({}, 'start of month')",
+}
+
+# Rollups of the keys in temp.rollup_keys and the periods overlapping [?, ?] are
+# recomputed from the daily rows. Every lookup, including the first/last day
+# open/close, is a range or point search of the unique (key, date) indexes.
+REFRESH_STOCK_PRICE_ROLLUP_SQL = '''
+    INSERT INTO stock_stockpricerolluphistory(company_id,period,period_date,open_price,
+    close_price,high_price,low_price,volume,day_count)
+    SELECT g.company_id, ?, g.period_date,
+    (SELECT open_price FROM stock_stockpricedailyhistory d
+     WHERE d.company_id=g.company_id AND d.price_date=g.first_date),
+    (SELECT close_price FROM stock_stockpricedailyhistory d
+     WHERE d.company_id=g.company_id AND d.price_date=g.last_date),
+    g.high_price, g.low_price, g.volume, g.day_count
+    FROM (SELECT company_id, {period} AS period_date, min(price_date) AS first_date,
+          max(price_date) AS last_date, max(high_price) AS high_price,
+          min(low_price) AS low_price, sum(volume) AS volume, count(*) AS day_count
+          FROM stock_stockpricedailyhistory
+          WHERE company_id IN (SELECT key FROM temp.rollup_keys)
+          AND price_date BETWEEN ? AND ?
+          GROUP BY company_id, period_date) AS g
+    WHERE 1
+    ON CONFLICT(company_id,period,period_date) DO UPDATE SET
+    open_price=excluded.open_price, close_price=excluded.close_price,
+    high_price=excluded.high_price, low_price=excluded.low_price,
+    volume=excluded.volume, day_count=excluded.day_count
+'''
+
+REFRESH_STOCK_INDEX_ROLLUP_SQL = '''
+    INSERT INTO stock_asxindexrolluphistory(index_name,period,period_date,open_index,
+    close_index,high_index,low_index,day_count)
+    SELECT g.index_name, ?, g.period_date,
+    (SELECT open_index FROM stock_asxindexdailyhistory d
+     WHERE d.index_name=g.index_name AND d.index_date=g.first_date),
+    (SELECT close_index FROM stock_asxindexdailyhistory d
+     WHERE d.index_name=g.index_name AND d.index_date=g.last_date),
+    g.high_index, g.low_index, g.day_count
+    FROM (SELECT index_name, {period} AS period_date, min(index_date) AS first_date,
+          max(index_date) AS last_date, max(high_index) AS high_index,
+          min(low_index) AS low_index, count(*) AS day_count
+          FROM stock_asxindexdailyhistory
+          WHERE index_name IN (SELECT key FROM temp.rollup_keys)
+          AND index_date BETWEEN ? AND ?
+          GROUP BY index_name, period_date) AS g
+    WHERE 1
+    ON CONFLICT(index_name,period,period_date) DO UPDATE SET
+    open_index=excluded.open_index, close_index=excluded.close_index,
+    high_index=excluded.high_index, low_index=excluded.low_index,
+    day_count=excluded.day_count
+'''
+
+
+def create_unique_indexes(conn):
+    with conn:
+        for sql in CREATE_UNIQUE_INDEX_SQLS:
+            conn.execute(sql)
+
+
+def has_rollup_tables(conn):
+    rollup_tables = [rollup_table for _, _, _, rollup_table in DAILY_TABLES.values()]
+    count = conn.execute(f'SELECT count(*) FROM sqlite_master WHERE type=\'table\' AND name IN '
+                         f'({",".join("?" * len(rollup_tables))})', rollup_tables).fetchone()[0]
+    return count == len(rollup_tables)
+
+
+def fill_rollup_tables(conn):
+    # rollups are built once for the existing daily rows, then kept up to date by insert_data_rows
+    if not has_rollup_tables(conn):
+        print('rollup tables not found, run the stock app migrations to maintain them')
+        return
+    with conn:
+        for data_name, (table, key_column, date_column, rollup_table) in DAILY_TABLES.items():
+            if conn.execute(f'SELECT count(*) FROM {rollup_table}').fetchone()[0] > 0:
+                continue
+            first_date, last_date = conn.execute(
+                f'SELECT min({date_column}),max({date_column}) FROM {table}').fetchone()
+            if first_date:
+                keys = [key for key, in conn.execute(
+                    f'SELECT DISTINCT {key_column} FROM {table} WHERE {key_column} IS NOT NULL')]
+                refresh_rollups(conn, data_name, keys, first_date, last_date)
+
+
+def get_period_bounds(period, first_date_str, last_date_str):
+    # first and last day of the periods covering the dates
+    first_date = datetime.strptime(first_date_str, '%Y-%m-%d').date()
+    last_date = datetime.strptime(last_date_str, '%Y-%m-%d').date()
+    if period == 'weekly':
+        first_date -= timedelta(days=first_date.weekday())
+        last_date += timedelta(days=6 - last_date.weekday())
+    else:
+        first_date = first_date.replace(day=1)
+        last_date = (last_date.replace(day=28) + timedelta(days=4)).replace(day=1) \
+            + timedelta(days=-1)
+    return first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d')
+
+
+def refresh_rollups(conn, data_name, keys, first_date_str, last_date_str):
+    # called inside the transaction that inserted the daily rows, only the
+    # companies (or indexes) written are refreshed
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS rollup_keys(key PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.rollup_keys')
+    conn.executemany('INSERT OR IGNORE INTO temp.rollup_keys(key) VALUES(?)',
+                     [(key,) for key in keys])
+    sql = REFRESH_STOCK_INDEX_ROLLUP_SQL if data_name == 'index' else REFRESH_STOCK_PRICE_ROLLUP_SQL
+    date_column = DAILY_TABLES[data_name][2]
+    for period, expression in ROLLUP_PERIODS.items():
+        first_date, last_date = get_period_bounds(period, first_date_str, last_date_str)
+        conn.execute(sql.format(period=expression.format(date_column)),
+                     (period, first_date, last_date))
+
+
+def prepare_database(conn):
+    create_unique_indexes(conn)
+    fill_rollup_tables(conn)
+
+
+def load_company_ids(conn):
+    # ASX code without the "ASX:" prefix -> company id
+    cur = conn.cursor()
+    cur.execute('SELECT code,id FROM stock_company')
+    return {code.split(':')[-1].upper(): company_id for code, company_id in cur.fetchall()}
+
+
+def parse_stock_price_lines(lines, company_ids):
+    now = datetime.now()
+    rows = []
+    for line in lines:
+        values = [value.strip() for value in line.split(',')]
+        if len(values) < 7:
+            if line.strip():
+                print(f'{line.strip()}-invalid line')
+            continue
+        code, price_date, price_open, price_close, price_high, price_low, stock_volume = values[:7]
+        company_id = company_ids.get(code.upper())
+        if company_id is None:
+            continue
+        rows.append((f'{code}:{price_date}', price_date, price_open, price_close,
+                     price_high, price_low, stock_volume, company_id, now, now, False))
+    return rows
+
+
+def parse_stock_index_lines(lines):
+    now = datetime.now()
+    rows = []
+    for line in lines:
+        values = [value.strip() for value in line.split(',')]
+        if len(values) < 6 or values[0] not in stock_index_codes:
+            if line.strip():
+                print(f'{line.strip()}-invalid line')
+            continue
+        code, index_date, index_open, index_close, index_high, index_low = values[:6]
+        rows.append((f'{stock_index_codes[code]}:{index_date}', code, index_date,
+                     index_open, index_close, index_high, index_low, now, now, False))
+    return rows
+
+
+def insert_stock_price_history(conn, lines, company_ids):
+    # one transaction per file, returns the number of rows created
+    return insert_data_rows(conn, 'price', parse_stock_price_lines(lines, company_ids))
+
+
+def insert_stock_index_history(conn, lines):
+    return insert_data_rows(conn, 'index', parse_stock_index_lines(lines))
+
+
+def parse_data_lines(data_name, lines, company_ids):
+    if data_name == 'index':
+        return parse_stock_index_lines(lines)
+    return parse_stock_price_lines(lines, company_ids)
+
+
+def insert_data_rows(conn, data_name, rows, updated_date_str=None):
+    # rows and the new updated date are committed together, the updated date
+    # never moves backwards, returns the rows created
+    total_changes = conn.total_changes
+    with conn:
+        conn.executemany(INSERT_STOCK_INDEX_SQL if data_name == 'index' else INSERT_STOCK_PRICE_SQL,
+                         rows)
+        created = conn.total_changes - total_changes
+        if created > 0 and has_rollup_tables(conn):
+            # (date, key) positions in the parsed rows
+            date_index, key_index = (2, 1) if data_name == 'index' else (1, 7)
+            dates = [row[date_index] for row in rows]
+            refresh_rollups(conn, data_name, {row[key_index] for row in rows},
+                            min(dates), max(dates))
+        if updated_date_str:
+            # max() of sqlite is NULL when the checkpoint is not set yet (empty tables)
+            conn.execute('UPDATE stock_dataupdatehistory '
+                         'SET updated_date=max(coalesce(updated_date,?),?) WHERE data_name=?',
+                         (updated_date_str, updated_date_str, data_name))
+    return created
+
+
+def get_data_file_name(data_name, data_date):
+    year = str(data_date.year).zfill(2)
+    month = str(data_date.month).zfill(2)
+    day = str(data_date.day).zfill(2)
+    return f'{data_name}/{year}/{month}/stock_{data_name}_{year}_{month}_{day}.csv'
+
+
+def get_update_history(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT data_name,updated_date FROM stock_dataupdatehistory")
+    rows = cur.fetchall()
+
+    if len(rows) == 0:
+        cur.execute("select max(index_date) from stock_asxindexdailyhistory")
+        data_date = cur.fetchone()
+        rows.append(['index', data_date[0]])
+        cur.execute('INSERT INTO stock_dataupdatehistory(updated_date,data_name) VALUES (?,?)',
+                    (data_date[0], 'index'))
+        conn.commit()
+        cur.execute("select max(price_date) from stock_stockpricedailyhistory")
+        data_date = cur.fetchone()
+        rows.append(['price', data_date[0]])
+        cur.execute('INSERT INTO stock_dataupdatehistory(updated_date,data_name) VALUES (?,?)',
+                    (data_date[0], 'price'))
+        conn.commit()
+    return rows
+
+
+def update_stock_data(conn):
+    prepare_database(conn)
+    company_ids = load_company_ids(conn)
+    for row in get_update_history(conn):
+        data_name = row[0]
+        update_date_str = row[1]
+        update_date = datetime.strptime(update_date_str, '%Y-%m-%d').date()
+        today = date.today()
+        days = (today - update_date).days
+
+        for day in range(-days + 1, 0):
+            retrieve_date = today + timedelta(days=day)
+            retrieve_date_str = retrieve_date.strftime('%Y-%m-%d')
+
+            file_name = get_data_file_name(data_name, retrieve_date)
+            print(f'Downloading {file_name}')
+            create_directory_if_not_exist(os.path.dirname(f'data/{file_name}'))
+            download_file(file_name)
+
+            with open(f'data/{file_name}') as data_file:
+                lines = data_file.read().splitlines()
+            if not lines or lines[0].strip() == '':
+                os.remove(f'data/{file_name}')
+            else:
+                rows = parse_data_lines(data_name, lines, company_ids)
+                created = insert_data_rows(conn, data_name, rows, retrieve_date_str)
+                print(f'{file_name}: {created} of {len(lines)} rows created')
+                print(f'{data_name} last updated date set to {retrieve_date_str}')
+
+
+if __name__ == '__main__':
+    conn = connect_writer(db_file)
+    update_stock_data(conn)
+    conn.close()